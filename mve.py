@@ -6,10 +6,12 @@
 # license: GPL
 #
 
-import cv2, json, math, struct
+import cv2, io, json, math, os, struct
 import numpy as np
 
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
+from fnmatch import fnmatch
 from pathlib import Path, PurePath
 
 from PIL import Image
@@ -27,93 +29,223 @@ IMAGE_TYPE_SINT64   = 8
 IMAGE_TYPE_FLOAT    = 9
 IMAGE_TYPE_DOUBLE   = 10
 
+BUNDLE_CAMERA_DTYPE = np.dtype([
+  ('focal_length', np.float64),
+  ('distortion', np.float64, (2,)),
+  ('rotation', np.float64, (3,3)),
+  ('translation', np.float64, (3,))
+])
+BUNDLE_FEATURE_DTYPE = np.dtype([
+  ('position', np.float32, (3,)),
+  ('color', np.uint8, (3,)),
+  ('first', np.uint32),
+  ('count', np.uint32)
+])
+BUNDLE_REF_DTYPE = np.dtype([
+  ('feature', np.uint32),
+  ('view', np.int32),
+  ('key', np.int32)
+])
+
+
+MANIFEST_VERSION    = 'tagger-manifest 1.0'
+MANIFEST_FILENAME   = 'tagger-manifest.json'
+FEATURES_FILENAME   = 'tagger-features.npz'
+
+ASSET_NAMES         = [ 'original', 'thumbnail', 'undistorted', 'depth', 'depthcolor', 'depthconf', 'depthviews', 'ply' ]
+
+MVEI_SIGNATURE      = b"\211MVE_IMAGE\n"
+MVEI_HEADER_SIZE    = 11 + 4*4
+
+
+def parsemveiheaders(f, path):
+  # read mvei signature
+  signature = f.read(11)
+  if signature != MVEI_SIGNATURE:
+    raise Exception('Invalid mvei header: %s' % path)
+
+  # read mvei header
+  header = f.read(4*4)
+  (width, height, channels, rawtype) = struct.unpack('=IIII', header)
+
+  # convert datatype to numpy
+  if rawtype == IMAGE_TYPE_UINT8:
+    dtype = np.uint8
+  elif rawtype == IMAGE_TYPE_UINT16:
+    dtype = np.uint16
+  elif rawtype == IMAGE_TYPE_UINT32:
+    dtype = np.uint32
+  elif rawtype == IMAGE_TYPE_UINT64:
+    dtype = np.uint64
+  elif rawtype == IMAGE_TYPE_SINT8:
+    dtype = np.int8
+  elif rawtype == IMAGE_TYPE_SINT16:
+    dtype = np.int16
+  elif rawtype == IMAGE_TYPE_SINT32:
+    dtype = np.int32
+  elif rawtype == IMAGE_TYPE_SINT64:
+    dtype = np.int64
+  elif rawtype == IMAGE_TYPE_FLOAT:
+    dtype = np.float32
+  elif rawtype == IMAGE_TYPE_DOUBLE:
+    dtype = np.float64
+  else:
+    raise Exception('Unsupported mvei format (%d): %s' % (rawtype, path))
+  return (width, height, channels, dtype)
 
 def readmveiheaders(path):
   with Path(path).open('rb') as f:
-    # read mvei signature
-    signature = f.read(11)
-    if signature != b"\211MVE_IMAGE\n":
-      raise Exception('Invalid mvei header: %s' % path)
-
-    # read mvei header
-    header = f.read(4*4)
-    (width, height, channels, rawtype) = struct.unpack('=IIII', header)
-
-    # convert datatype to numpy
-    if rawtype == IMAGE_TYPE_UINT8:
-      dtype = np.uint8
-    elif rawtype == IMAGE_TYPE_UINT16:
-      dtype = np.uint16
-    elif rawtype == IMAGE_TYPE_UINT32:
-      dtype = np.uint32
-    elif rawtype == IMAGE_TYPE_UINT64:
-      dtype = np.uint64
-    elif rawtype == IMAGE_TYPE_SINT8:
-      dtype = np.int8
-    elif rawtype == IMAGE_TYPE_SINT16:
-      dtype = np.int16
-    elif rawtype == IMAGE_TYPE_SINT32:
-      dtype = np.int32
-    elif rawtype == IMAGE_TYPE_SINT64:
-      dtype = np.int64
-    elif rawtype == IMAGE_TYPE_FLOAT:
-      dtype = np.float32
-    elif rawtype == IMAGE_TYPE_DOUBLE:
-      dtype = np.float64
-    else:
-      raise Exception('Unsupported mvei format (%d): %s' % (rawtype, path))
-    return (width, height, channels, dtype)
-
-def readmvei(path):
-  # read header
-  (width, height, channels, dtype) = readmveiheaders(path)
+    return parsemveiheaders(f, path)
 
-  # read image
+def readmvei(path, mmap=False):
   with Path(path).open('rb') as f:
-    f.seek(11+4*4)
+    # read header
+    (width, height, channels, dtype) = parsemveiheaders(f, path)
+
+    # map image read-only (pages are loaded on first access)
+    if mmap:
+      return np.memmap(
+        f,
+        dtype=dtype,
+        mode='r',
+        offset=MVEI_HEADER_SIZE,
+        shape=(height, width, channels)
+      )
+
+    # read image
     return np.fromfile(f, dtype=dtype, count=width*height*channels).reshape((height, width, channels))
 
 
 def readbundle(path):
-  cameras=list()
-  features=list()
   with Path(path).open('r') as f:
     header = f.readline().strip()
     if header != 'drews 1.0':
       raise Exception("unsupported bundle file (%s)" % header)
-    (nbcameras, nbfeatures) = f.readline().strip().split(' ')
-    for i in range(int(nbcameras)):
-      (focal, k1, k2) = f.readline().strip().split(' ')
-      (r11, r12, r13) = f.readline().strip().split(' ')
-      (r21, r22, r23) = f.readline().strip().split(' ')
-      (r31, r32, r33) = f.readline().strip().split(' ')
-      (tx,   ty,  tz) = f.readline().strip().split(' ')
-      cameras.append({
-        'focal_length': float(focal),
-        'distortion': [float(k1), float(k2)],
-        'rotation': np.array(
-          [
-            [float(r11), float(r12), float(r13)],
-            [float(r21), float(r22), float(r23)],
-            [float(r31), float(r32), float(r33)]
-          ],
-          dtype=np.float64
-        ),
-        'translation': np.array(
-          [float(tx), float(ty), float(tz)],
-          dtype=np.float64
-        )
-      })
-    # TODO: read features?
+    (nbcameras, nbfeatures) = [ int(x) for x in f.readline().split() ]
+    lines = f.read().splitlines()
+  if len(lines) < 5*nbcameras + 3*nbfeatures:
+    raise Exception("truncated bundle file: %s" % path)
+
+  # camera block: 5 lines (focal k1 k2, rotation, translation) per camera
+  values = np.fromstring(' '.join(lines[0:5*nbcameras]), dtype=np.float64, sep=' ')
+  if values.size != 15*nbcameras:
+    raise Exception("invalid bundle cameras: %s" % path)
+  values = values.reshape((nbcameras, 15))
+  cameras = np.zeros((nbcameras,), dtype=BUNDLE_CAMERA_DTYPE)
+  cameras['focal_length'] = values[:,0]
+  cameras['distortion'] = values[:,1:3]
+  cameras['rotation'] = values[:,3:12].reshape((nbcameras, 3, 3))
+  cameras['translation'] = values[:,12:15]
+
+  # feature block: 3 lines (position, color, track) per feature
+  features = np.zeros((nbfeatures,), dtype=BUNDLE_FEATURE_DTYPE)
+  refs = np.zeros((0,), dtype=BUNDLE_REF_DTYPE)
+  if nbfeatures > 0:
+    block = lines[5*nbcameras:5*nbcameras+3*nbfeatures]
+    positions = np.fromstring(' '.join(block[0::3]), dtype=np.float32, sep=' ')
+    colors = np.fromstring(' '.join(block[1::3]), dtype=np.int32, sep=' ')
+    if positions.size != 3*nbfeatures or colors.size != 3*nbfeatures:
+      raise Exception("invalid bundle features: %s" % path)
+    features['position'] = positions.reshape((nbfeatures, 3))
+    features['color'] = np.clip(colors, 0, 255).reshape((nbfeatures, 3))
+
+    # each track is "<count> (<view> <key> ...){count}", the number of
+    # values per reference is 3 for mve and 4 for bundler files
+    tracks = block[2::3]
+    counts = np.array([ line.split(None, 1)[0] for line in tracks ], dtype=np.int64)
+    values = np.fromstring(' '.join(tracks), dtype=np.float64, sep=' ')
+    total = int(counts.sum())
+    width = (values.size - nbfeatures) // max(1, total)
+    if total > 0 and (width < 2 or values.size != nbfeatures + width*total):
+      raise Exception("invalid bundle tracks: %s" % path)
+    offsets = np.zeros((nbfeatures,), dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)[:-1]
+    features['first'] = offsets
+    features['count'] = counts
+    if total > 0:
+      mask = np.ones((values.size,), dtype=bool)
+      mask[np.arange(nbfeatures) + width*offsets] = False
+      values = values[mask].reshape((total, width))
+      refs = np.zeros((total,), dtype=BUNDLE_REF_DTYPE)
+      refs['feature'] = np.repeat(np.arange(nbfeatures, dtype=np.uint32), counts)
+      refs['view'] = values[:,0]
+      refs['key'] = values[:,1]
+  return (cameras, features, refs)
+
+
+def readdepthpoints(depthpath, colorpath, confpath, intrinsic, camera2world):
+  # only pixels with a valid depth are decoded
+  depth = readmvei(depthpath, True)[:,:,0]
+  (height, width) = depth.shape
+  (rows, cols) = np.nonzero(depth > 0)
+  count = rows.shape[0]
+
+  # unproject pixel centers through the view frustum, depth is the
+  # distance along the ray to the camera center
+  ndc = np.empty((4, count), dtype=np.float64)
+  ndc[0] = 2 * (cols + 0.5) / width - 1
+  ndc[1] = 1 - 2 * (rows + 0.5) / height
+  ndc[2] = -1
+  ndc[3] = 1
+  rays = np.linalg.inv(intrinsic) @ ndc
+  rays = rays[0:3] / rays[3]
+  rays[1:3] = -rays[1:3]
+  rays *= depth[rows, cols] / np.linalg.norm(rays, axis=0)
+  vertices = (camera2world[0:3,0:3] @ rays + camera2world[0:3,3:4]).T.astype(np.float32)
+
+  colors = np.full((count, 4), 255, dtype=np.uint8)
+  if colorpath:
+    image = cv2.imread(colorpath)
+    if image.shape[0:2] != (height, width):
+      image = cv2.resize(image, (width, height), interpolation=cv2.INTER_NEAREST)
+    colors[:,0:3] = image[rows, cols, ::-1]
+  if confpath:
+    confidence = readmvei(confpath, True)[:,:,0]
+    colors[:,3] = np.clip(confidence[rows, cols] * 255.0, 0, 255).astype(np.uint8)
+  return (vertices, colors)
+
+
+def mtime(path):
+  try:
+    return os.stat(path).st_mtime_ns
+  except OSError:
+    return 0
+
+
+def cameras2json(cameras):
+  return [
+    {
+      'focal_length': float(camera['focal_length']),
+      'distortion': camera['distortion'].tolist(),
+      'rotation': camera['rotation'].tolist(),
+      'translation': camera['translation'].tolist()
+    }
+    for camera in cameras
+  ]
+
+def json2cameras(data):
+  cameras = np.zeros((len(data),), dtype=BUNDLE_CAMERA_DTYPE)
+  for (i, item) in enumerate(data):
+    cameras[i]['focal_length'] = item['focal_length']
+    cameras[i]['distortion'] = item['distortion']
+    cameras[i]['rotation'] = item['rotation']
+    cameras[i]['translation'] = item['translation']
   return cameras
 
 
 class MVEView(object):
-  def __init__(self, scene, path):
+  def __init__(self, scene, path, data=None):
     self.scene = scene
     self.path = path
+    self.assetTable = None
+    if data:
+      self.load(data)
+    else:
+      self.scan()
+
+  def scan(self):
     meta = ConfigParser()
-    meta.read(path / 'meta.ini')
+    meta.read(self.path / 'meta.ini')
     if 'view' in meta:
       self.id = int(meta['view']['id'])
       self.name = meta['view']['name']
@@ -125,7 +257,7 @@ class MVEView(object):
     if 'camera' in meta:
       self.camera = self.scene.cameras[self.id]
       self.focal_length = float(meta['camera']['focal_length'])
-      self.distortion = self.camera['distortion']
+      self.distortion = self.camera['distortion'].tolist()
       self.pixel_aspect = float(meta['camera']['pixel_aspect'])
       self.principal_point = np.array(
         [ float(x) for x in meta['camera']['principal_point'].strip().split(' ') ],
@@ -171,6 +303,45 @@ class MVEView(object):
       self.depthWidth = 0
       self.depthHeight = 0
 
+  def load(self, data):
+    self.id = data['id']
+    self.name = data['name']
+    if self.id >= 0 and self.id < len(self.scene.cameras):
+      self.camera = self.scene.cameras[self.id]
+    self.focal_length = data['focal_length']
+    self.distortion = data['distortion']
+    self.pixel_aspect = data['pixel_aspect']
+    self.principal_point = np.array(data['principal_point'], dtype=np.float64)
+    self.rotation = np.array(data['rotation'], dtype=np.float64)
+    self.translation = np.array(data['translation'], dtype=np.float64)
+    (self.width, self.height) = data['size']
+    (self.depthWidth, self.depthHeight) = data['depthsize']
+    if all([ name in data for name in ASSET_NAMES ]) and 'levels' in data:
+      self.assetTable = dict()
+      for name in ASSET_NAMES:
+        self.assetTable[name] = self.relocate(data[name])
+      self.assetTable['levels'] = list()
+      for item in data['levels']:
+        self.assetTable['levels'].append({
+          'level': item['level'],
+          'depth': self.relocate(item['depth']),
+          'depthcolor': self.relocate(item['depthcolor']),
+          'depthconf': self.relocate(item['depthconf']),
+          'depthviews': self.relocate(item['depthviews'])
+        })
+
+  def relocate(self, filename):
+    if not filename:
+      return None
+    return str(self.path / PurePath(filename).name)
+
+  def stamp(self):
+    return [
+      mtime(self.path),
+      mtime(self.path / 'meta.ini'),
+      mtime(self.path / 'original.jpg')
+    ]
+
   def toJSON(self):
     return {
       'id': self.id,
@@ -187,7 +358,10 @@ class MVEView(object):
       'undistorted': self.undistorted(),
       'depth': self.depth(),
       'depthcolor': self.depthcolor(),
+      'depthconf': self.depthconf(),
       'depthviews': self.depthviews(),
+      'ply': self.ply(),
+      'levels': self.assets()['levels'],
       'depthsize': [self.depthWidth, self.depthHeight],
     }
 
@@ -241,54 +415,110 @@ class MVEView(object):
   def position(self):
     return -(self.rotation[0:3,0:3].T @ self.translation)
 
-  def original(self):
-    path = self.path / 'original.jpg'
-    if path.exists():
-      return str(path)
+  def assets(self):
+    if self.assetTable is None:
+      self.assetTable = self.scanassets()
+    return self.assetTable
+
+  def scanassets(self):
+    try:
+      names = set(os.listdir(self.path))
+    except OSError:
+      names = set()
+    assets = dict()
+    for name in ASSET_NAMES:
+      assets[name] = None
+    for (name, filename) in [ ('original', 'original.jpg'), ('thumbnail', 'thumbnail.png'), ('undistorted', 'undistorted.png') ]:
+      if filename in names:
+        assets[name] = str(self.path / filename)
+    levels = list()
+    for filename in [ name for name in names if fnmatch(name, 'depth-L*.mvei') ]:
+      try:
+        level = int(filename[len('depth-L'):-len('.mvei')])
+      except ValueError:
+        continue
+      item = {
+        'level': level,
+        'depth': str(self.path / filename),
+        'depthcolor': None,
+        'depthconf': None,
+        'depthviews': None
+      }
+      for (name, filename2) in [ ('depthcolor', 'undist-L%d.png'), ('depthconf', 'conf-L%d.mvei'), ('depthviews', 'views-L%d.mvei') ]:
+        if filename2 % level in names:
+          item[name] = str(self.path / (filename2 % level))
+      levels.append(item)
+    assets['levels'] = sorted(levels, key=lambda x: x['level'])
+    for item in assets['levels']:
+      for name in [ 'depth', 'depthcolor', 'depthconf', 'depthviews' ]:
+        if not assets[name]:
+          assets[name] = item[name]
+    if not assets['depthcolor']:
+      assets['depthcolor'] = assets['undistorted']
+    for filename in [ 'pointcloud.ply', 'pointcloud.ply.gz', 'pointcloud.ply.xz' ]:
+      if filename in names:
+        assets['ply'] = str(self.path / filename)
+        break
+    return assets
+
+  def invalidate(self):
+    self.assetTable = None
+
+  def levels(self):
+    return [ item['level'] for item in self.assets()['levels'] ]
+
+  def levelassets(self, level):
+    for item in self.assets()['levels']:
+      if item['level'] == level:
+        return item
+    raise Exception("depth level %d not found: %s" % (level, self.path))
+
+  def levelsize(self, level):
+    (width, height, channels, dtype) = readmveiheaders(self.depth(level))
+    return (width, height)
+
+  def chooselevel(self, budget):
+    # finest level whose depth map fits in the point budget
+    levels = self.levels()
+    for level in levels:
+      (width, height) = self.levelsize(level)
+      if width * height <= budget:
+        return level
+    if len(levels) > 0:
+      return levels[-1]
     return None
 
+  def original(self):
+    return self.assets()['original']
+
   def thumbnail(self):
-    path = self.path / 'thumbnail.png'
-    if path.exists():
-      return str(path)
-    return None
+    return self.assets()['thumbnail']
 
   def undistorted(self):
-    path = self.path / 'undistorted.png'
-    if path.exists():
-      return str(path)
-    return None
+    return self.assets()['undistorted']
 
-  def depth(self):
-    for path in sorted(self.path.glob('depth-L*.mvei')):
-      return str(path)
-    return None
+  def depth(self, level=None):
+    if level is None:
+      return self.assets()['depth']
+    return self.levelassets(level)['depth']
 
-  def depthcolor(self):
-    for path in sorted(self.path.glob('depth-L*.mvei')):
-      path = path.with_name(path.stem.replace('depth', 'undist') + '.png')
-      if path.exists():
-        return str(path)
-    return self.undistorted()
-
-  def depthviews(self):
-    for path in sorted(self.path.glob('depth-L*.mvei')):
-      path = path.with_name(path.stem.replace('depth', 'views') + '.mvei')
-      if path.exists():
-        return str(path)
-    return None
+  def depthcolor(self, level=None):
+    if level is None:
+      return self.assets()['depthcolor']
+    return self.levelassets(level)['depthcolor'] or self.undistorted()
+
+  def depthconf(self, level=None):
+    if level is None:
+      return self.assets()['depthconf']
+    return self.levelassets(level)['depthconf']
+
+  def depthviews(self, level=None):
+    if level is None:
+      return self.assets()['depthviews']
+    return self.levelassets(level)['depthviews']
 
   def ply(self):
-    path = self.path / 'pointcloud.ply'
-    if path.exists():
-      return str(path)
-    path = self.path / 'pointcloud.ply.gz'
-    if path.exists():
-      return str(path)
-    path = self.path / 'pointcloud.ply.xz'
-    if path.exists():
-      return str(path)
-    return None
+    return self.assets()['ply']
 
   def readoriginal(self):
     return cv2.imread(self.original())
@@ -299,22 +529,66 @@ class MVEView(object):
   def readundistorted(self):
     return cv2.imread(self.undistorted())
 
-  def readdepth(self):
-    return readmvei(self.depth())
+  def readdepth(self, mmap=True, level=None):
+    return readmvei(self.depth(level), mmap)
+
+  def readdepthcolor(self, level=None):
+    return cv2.imread(self.depthcolor(level))
 
-  def readdepthcolor(self):
-    return cv2.imread(self.depthcolor())
+  def readdepthconf(self, mmap=True, level=None):
+    return readmvei(self.depthconf(level), mmap)
 
-  def readdepthviews(self):
-    return readmvei(self.depthviews())
+  def readdepthviews(self, mmap=True, level=None):
+    return readmvei(self.depthviews(level), mmap)
+
+  def readpoints(self, near=0.1, far=50.1, level=None):
+    return readdepthpoints(*self.depthpoints(near, far, level))
+
+  def depthpoints(self, near=0.1, far=50.1, level=None):
+    # arguments of readdepthpoints() for this view
+    (width, height) = self.levelsize(level) if level is not None else readmveiheaders(self.depth())[0:2]
+    return (
+      self.depth(level),
+      self.depthcolor(level),
+      self.depthconf(level),
+      self.intrinsic(width, height, near, far),
+      self.camera2world()
+    )
 
 
 class MVEViews(object):
-  def __init__(self, scene):
+  def __init__(self, scene, workers=8, manifest=dict()):
     self.scene = scene
     self.path = self.scene.path / 'views'
+    self.manifest = dict()
+    self.changed = False
+    views = list()
+    children = list()
+    for child in self.path.iterdir():
+      if not child.is_dir():
+        continue
+      entry = manifest.get(child.name)
+      if entry:
+        view = MVEView(self.scene, child, entry['view'])
+        if view.stamp() == entry['stamp']:
+          self.manifest[child.name] = entry
+          views.append(view)
+          continue
+      children.append(child)
+    if workers > 1 and len(children) > 1:
+      with ThreadPoolExecutor(max_workers=workers) as executor:
+        scanned = list(executor.map(lambda child: MVEView(self.scene, child), children))
+    else:
+      scanned = [ MVEView(self.scene, child) for child in children ]
+    for view in scanned:
+      self.manifest[view.path.name] = {
+        'stamp': view.stamp(),
+        'view': view.toJSON()
+      }
+    views += scanned
+    self.changed = len(scanned) > 0 or len(self.manifest) != len(manifest)
     self.items = sorted(
-      [ view for view in [ MVEView(self.scene, child) for child in self.path.iterdir() if child.is_dir() ] if view.valid() ],
+      [ view for view in views if view.valid() ],
       key=lambda v: v.id
     )
 
@@ -327,6 +601,10 @@ class MVEViews(object):
   def __str__(self):
     return json.dumps(self.toJSON(), indent='  ')
 
+  def invalidate(self):
+    for item in self.items:
+      item.invalidate()
+
   def validitems(self):
     return [ view for view in self.items if view.ready() ]
 
@@ -335,15 +613,87 @@ class MVEViews(object):
 
 
 class MVEScene(object):
-  def __init__(self, path):
+  def __init__(self, path, workers=8, cache=True):
     self.path = Path(path)
-    self.cameras = readbundle(self.path / 'synth_0.out')
-    self.views = MVEViews(self)
+    self.bundle = self.path / 'synth_0.out'
+    self.tracks = None
+    manifest = self.readmanifest() if cache else None
+    if manifest and manifest['bundle'] == mtime(self.bundle):
+      self.cameras = json2cameras(manifest['cameras'])
+      self.views = MVEViews(self, workers, manifest['views'])
+      changed = self.views.changed
+    else:
+      (self.cameras, features, refs) = readbundle(self.bundle)
+      self.tracks = (features, refs)
+      self.views = MVEViews(self, workers)
+      changed = True
+    if cache and changed:
+      self.writemanifest()
+      if self.tracks:
+        self.writefeatures()
+
+  def features(self):
+    # tracks come from the features cache when the bundle is unchanged
+    if not self.tracks:
+      self.tracks = self.readfeatures()
+    if not self.tracks:
+      (cameras, features, refs) = readbundle(self.bundle)
+      self.tracks = (features, refs)
+      self.writefeatures()
+    return self.tracks
+
+  def readfeatures(self):
+    path = self.path / FEATURES_FILENAME
+    try:
+      with np.load(path) as data:
+        if int(data['bundle']) != mtime(self.bundle):
+          return None
+        return (data['features'], data['refs'])
+    except (OSError, KeyError, ValueError):
+      return None
+
+  def writefeatures(self):
+    path = self.path / FEATURES_FILENAME
+    tmppath = path.with_name(path.name + '.tmp')
+    (features, refs) = self.tracks
+    try:
+      with io.open(tmppath, 'wb') as f:
+        np.savez(f, bundle=np.int64(mtime(self.bundle)), features=features, refs=refs)
+      os.replace(tmppath, path)
+    except OSError as e:
+      print("cannot write scene features %s (%s)" % (path, e))
+
+  def readmanifest(self):
+    path = self.path / MANIFEST_FILENAME
+    try:
+      with io.open(path, 'r') as f:
+        data = json.load(f)
+    except (OSError, ValueError):
+      return None
+    if data.get('version') != MANIFEST_VERSION:
+      return None
+    return data
+
+  def writemanifest(self):
+    path = self.path / MANIFEST_FILENAME
+    tmppath = path.with_name(path.name + '.tmp')
+    data = {
+      'version': MANIFEST_VERSION,
+      'bundle': mtime(self.bundle),
+      'cameras': cameras2json(self.cameras),
+      'views': self.views.manifest
+    }
+    try:
+      with io.open(tmppath, 'w') as f:
+        json.dump(data, f)
+      os.replace(tmppath, path)
+    except OSError as e:
+      print("cannot write scene manifest %s (%s)" % (path, e))
 
   def toJSON(self):
     return {
       'path': str(self.path),
-      'cameras': self.cameras,
+      'cameras': cameras2json(self.cameras),
       'views': self.views.toJSON()
     }
 
@@ -0,0 +1,103 @@
+# ply.py: fast binary ply vertex reader
+#
+# see http://paulbourke.net/dataformats/ply/
+#
+# author: Antony Ducommun dit Boudry (nitro.tm@gmail.com)
+# license: GPL
+#
+
+import numpy as np
+
+from pathlib import Path
+
+
+PLY_TYPES = {
+  'char': 'i1', 'int8': 'i1',
+  'uchar': 'u1', 'uint8': 'u1',
+  'short': 'i2', 'int16': 'i2',
+  'ushort': 'u2', 'uint16': 'u2',
+  'int': 'i4', 'int32': 'i4',
+  'uint': 'u4', 'uint32': 'u4',
+  'float': 'f4', 'float32': 'f4',
+  'double': 'f8', 'float64': 'f8',
+}
+
+
+def parseplyheader(f, path):
+  # read ply signature
+  if f.readline().strip() != b'ply':
+    raise Exception('Invalid ply header: %s' % path)
+
+  # read ply header until end_header
+  fmt = None
+  elements = list()
+  while True:
+    line = f.readline()
+    if not line:
+      raise Exception('Truncated ply header: %s' % path)
+    tokens = line.decode('ascii').split()
+    if len(tokens) == 0 or tokens[0] in ('comment', 'obj_info'):
+      continue
+    if tokens[0] == 'end_header':
+      break
+    if tokens[0] == 'format':
+      fmt = tokens[1]
+    elif tokens[0] == 'element':
+      elements.append((tokens[1], int(tokens[2]), list()))
+    elif tokens[0] == 'property':
+      if len(elements) == 0:
+        raise Exception('Invalid ply property: %s' % path)
+      if tokens[1] == 'list':
+        elements[-1][2].append((tokens[4], None))
+      else:
+        elements[-1][2].append((tokens[2], PLY_TYPES[tokens[1]]))
+  return (fmt, elements, f.tell())
+
+def plyvertexlayout(fmt, elements):
+  # (count, dtype) of vertex-only binary little endian files, None when
+  # the file must be handled by a generic reader
+  if fmt != 'binary_little_endian' or len(elements) != 1 or elements[0][0] != 'vertex':
+    return None
+  (name, count, properties) = elements[0]
+  if any([ ptype is None for (pname, ptype) in properties ]):
+    return None
+  return (count, np.dtype([ (pname, '<' + ptype) for (pname, ptype) in properties ]))
+
+def readplyvertices(path, mmap=True):
+  with Path(path).open('rb') as f:
+    layout = plyvertexlayout(*parseplyheader(f, path)[0:2])
+    if layout is None:
+      return None
+    (count, dtype) = layout
+    offset = f.tell()
+    if count == 0:
+      return np.zeros((0,), dtype=dtype)
+    if mmap:
+      return np.memmap(f, dtype=dtype, mode='r', offset=offset, shape=(count,))
+    return np.fromfile(f, dtype=dtype, count=count)
+
+def readplystream(f, path, chunksize=65536):
+  # header of a sequential stream (e.g. decompressed), returns
+  # (count, dtype, chunks) or None like readplyvertices
+  layout = plyvertexlayout(*parseplyheader(f, path)[0:2])
+  if layout is None:
+    return None
+  (count, dtype) = layout
+  return (count, dtype, iterplychunks(f, path, count, dtype, chunksize))
+
+def iterplychunks(f, path, count, dtype, chunksize=65536):
+  # yields (start, records) where records is only valid until the next
+  # chunk, the read buffer is reused
+  buffer = bytearray(chunksize * dtype.itemsize)
+  start = 0
+  while start < count:
+    size = min(chunksize, count - start)
+    view = memoryview(buffer)[0:size * dtype.itemsize]
+    offset = 0
+    while offset < len(view):
+      read = f.readinto(view[offset:])
+      if not read:
+        raise Exception('Truncated ply data: %s' % path)
+      offset += read
+    yield (start, np.frombuffer(buffer, dtype=dtype, count=size))
+    start += size
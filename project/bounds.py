@@ -0,0 +1,59 @@
+# bounds.py: bounding volume hierarchy over view bounding boxes
+#
+# author: Antony Ducommun dit Boudry (nitro.tm@gmail.com)
+# license: GPL
+#
+
+import numpy as np
+
+
+def intersects(pt, radius, bbox1, bbox2):
+  # sphere versus axis-aligned box
+  d = np.maximum(np.maximum(bbox1 - pt, pt - bbox2), 0)
+  return np.dot(d, d) <= radius * radius
+
+
+class BoundsTree(object):
+  LEAF_SIZE = 4
+
+
+  def __init__(self, items=list()):
+    # items: (item, bbox1, bbox2)
+    self.items = [ item for (item, bbox1, bbox2) in items ]
+    self.bbox1 = np.array([ bbox1 for (item, bbox1, bbox2) in items ], dtype=np.float64).reshape((-1, 3))
+    self.bbox2 = np.array([ bbox2 for (item, bbox1, bbox2) in items ], dtype=np.float64).reshape((-1, 3))
+    self.order = np.arange(0, len(self.items))
+    self.root = self.build(0, len(self.items)) if len(self.items) > 0 else None
+
+
+  def build(self, start, end):
+    # node: (bbox1, bbox2, children, start, end), split at the median
+    # center along the longest axis
+    indices = self.order[start:end]
+    bbox1 = np.amin(self.bbox1[indices], axis=0)
+    bbox2 = np.amax(self.bbox2[indices], axis=0)
+    if end - start <= BoundsTree.LEAF_SIZE:
+      return (bbox1, bbox2, None, start, end)
+    axis = np.argmax(bbox2 - bbox1)
+    centers = self.bbox1[indices, axis] + self.bbox2[indices, axis]
+    self.order[start:end] = indices[np.argsort(centers, kind='stable')]
+    middle = (start + end) // 2
+    return (bbox1, bbox2, (self.build(start, middle), self.build(middle, end)), start, end)
+
+  def query(self, pt, radius):
+    result = list()
+    if not self.root:
+      return result
+    pt = np.asarray(pt, dtype=np.float64)
+    stack = [ self.root ]
+    while len(stack) > 0:
+      (bbox1, bbox2, children, start, end) = stack.pop()
+      if not intersects(pt, radius, bbox1, bbox2):
+        continue
+      if children:
+        stack.extend(children)
+        continue
+      for i in self.order[start:end]:
+        if intersects(pt, radius, self.bbox1[i], self.bbox2[i]):
+          result.append(self.items[i])
+    return result
@@ -0,0 +1,139 @@
+# cache.py: on-disk cache of preprocessed point clouds
+#
+# author: Antony Ducommun dit Boudry (nitro.tm@gmail.com)
+# license: GPL
+#
+
+import hashlib, os, pickle, shutil, threading
+
+import numpy as np
+import scipy
+
+from pathlib import Path
+
+
+CACHE_VERSION = 'tagger-cloud 1.2'
+
+
+def defaultcachepath():
+  root = os.environ.get('XDG_CACHE_HOME')
+  if root:
+    return Path(root) / '3dtagger' / 'clouds'
+  return Path.home() / '.cache' / '3dtagger' / 'clouds'
+
+
+class CloudCache(object):
+  ARRAYS = [ 'points', 'bbox', 'order' ]
+
+
+  def __init__(self, path=None, maxsize=8*1024*1024*1024):
+    self.path = Path(path) if path else defaultcachepath()
+    self.maxsize = maxsize
+    self.lock = threading.Lock()
+
+
+  def key(self, filenames, tag=''):
+    h = hashlib.sha1()
+    h.update(CACHE_VERSION.encode('utf-8'))
+    h.update(tag.encode('utf-8'))
+    for filename in filenames:
+      if not filename:
+        continue
+      st = os.stat(filename)
+      h.update(('%s:%d:%d' % (os.path.abspath(filename), st.st_size, st.st_mtime_ns)).encode('utf-8'))
+    return h.hexdigest()
+
+  def load(self, key, mmap=True):
+    entry = self.path / key
+    try:
+      arrays = [ np.load(entry / (name + '.npy'), mmap_mode='r' if mmap else None) for name in CloudCache.ARRAYS ]
+      os.utime(entry)
+    except (OSError, ValueError):
+      return None
+    return tuple(arrays)
+
+  def store(self, key, points, bbox, order):
+    tmpentry = self.tmpentry(key)
+    try:
+      tmpentry.mkdir(parents=True, exist_ok=True)
+      for (name, data) in zip(CloudCache.ARRAYS, [ points, bbox, order ]):
+        np.save(tmpentry / (name + '.npy'), np.ascontiguousarray(data))
+    except OSError as e:
+      shutil.rmtree(tmpentry, ignore_errors=True)
+      print("cannot write cloud cache %s (%s)" % (self.path / key, e))
+      return False
+    return self.commit(key, tmpentry)
+
+  def tmpentry(self, key):
+    # private directory to write an entry into (e.g. from a worker process)
+    return self.path / ('%s.%d.%d.tmp' % (key, os.getpid(), threading.get_ident()))
+
+  def commit(self, key, tmpentry):
+    # publish a complete temporary entry, an existing entry is kept
+    entry = self.path / key
+    try:
+      with self.lock:
+        if entry.exists():
+          shutil.rmtree(tmpentry, ignore_errors=True)
+        else:
+          os.rename(tmpentry, entry)
+        self.evict()
+    except OSError as e:
+      shutil.rmtree(tmpentry, ignore_errors=True)
+      print("cannot write cloud cache %s (%s)" % (entry, e))
+      return False
+    return True
+
+  def indexpath(self, key, leafsize):
+    # pickles are only read back by the scipy version that wrote them
+    return self.path / key / ('kdtree-%d-scipy%s.pickle' % (leafsize, scipy.__version__))
+
+  def hasindex(self, key, leafsize):
+    return self.indexpath(key, leafsize).exists()
+
+  def loadindex(self, key, leafsize):
+    # pickled kd-trees keep their node buffers, loading does not rebuild;
+    # any failure (e.g. a damaged file) is a cache miss
+    try:
+      with self.indexpath(key, leafsize).open('rb') as f:
+        return pickle.load(f)
+    except Exception:
+      return None
+
+  def storeindex(self, key, leafsize, kdtree):
+    # attached to an existing cloud entry, evicted along with it
+    entry = self.path / key
+    if not entry.is_dir():
+      return
+    path = self.indexpath(key, leafsize)
+    tmppath = entry / ('%s.%d.%d.tmp' % (path.name, os.getpid(), threading.get_ident()))
+    try:
+      with tmppath.open('wb') as f:
+        pickle.dump(kdtree, f, protocol=pickle.HIGHEST_PROTOCOL)
+      os.replace(tmppath, path)
+      with self.lock:
+        self.evict()
+    except OSError as e:
+      if tmppath.exists():
+        tmppath.unlink()
+      print("cannot write index cache %s (%s)" % (path, e))
+
+  def evict(self):
+    # drop least-recently-used entries until the cache fits in maxsize
+    entries = list()
+    total = 0
+    for entry in self.path.iterdir():
+      if not entry.is_dir() or entry.name.endswith('.tmp'):
+        continue
+      size = sum([ item.stat().st_size for item in entry.iterdir() ])
+      entries.append((entry.stat().st_mtime, size, entry))
+      total += size
+    for (atime, size, entry) in sorted(entries, key=lambda x: x[0]):
+      if total <= self.maxsize:
+        break
+      shutil.rmtree(entry, ignore_errors=True)
+      total -= size
+
+  def clear(self):
+    with self.lock:
+      shutil.rmtree(self.path, ignore_errors=True)
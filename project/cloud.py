@@ -4,45 +4,196 @@
 # license: GPL
 #
 
-import io, math, sys, time
+import gzip, io, math, sys, time
 
 import numpy as np
 
+from pathlib import Path
+
+from plyfile import PlyData
+
+from mve import readdepthpoints
+from ply import readplystream, readplyvertices
+from xz import openxz
+
 
 class ProjectCloud(object):
-  def __init__(self, count=0, vertices=np.array((3,), dtype=np.float32), colors=np.array((4,), dtype=np.float32)):
-    self.count = count
-    self.vertices = vertices
-    self.colors = colors
+  SHUFFLE_SEED = 0x3d7a66e5
+
+  # interleaved layout shared with the vertex buffer (16 bytes per point)
+  POINT_DTYPE = np.dtype([
+    ('vertex', np.float32, (3,)),
+    ('color', np.uint8, (4,))
+  ])
+
+  # positions stored as normalized int16 relative to the bounding box,
+  # padded to keep 4-byte aligned attributes (12 bytes per point)
+  QUANTIZED_DTYPE = np.dtype([
+    ('vertex', np.int16, (3,)),
+    ('pad', np.int16),
+    ('color', np.uint8, (4,))
+  ])
+  QUANTIZED_RANGE = 32767
+
+
+  def __init__(self, points=np.zeros((0,), dtype=POINT_DTYPE)):
+    self.setpoints(points)
+    self.order = np.arange(0, self.count, dtype=np.uint32)
     self.buildbbox()
 
 
+  def setpoints(self, points):
+    self.count = points.shape[0]
+    self.points = points
+    self.vertices = points['vertex']
+    self.colors = points['color']
+
+  def shuffle(self, count):
+    # same point count gives the same order across sessions
+    rng = np.random.default_rng([ProjectCloud.SHUFFLE_SEED, count])
+    self.order = rng.permutation(count).astype(np.uint32)
+    return self.order
+
+  def loadfile(self, filename, workers=1):
+    if filename.endswith('.ply'):
+      data = readplyvertices(filename)
+      if data is not None:
+        self.loadvertices(data)
+        return
+    with openply(filename, workers) as f:
+      stream = readplystream(f, filename)
+      if stream is not None:
+        self.loadstream(*stream)
+        return
+    with openply(filename, workers) as f:
+      self.load(PlyData.read(f))
+
   def load(self, ply):
-    self.count = ply['vertex'].count
-    indices = np.random.permutation(np.arange(0, self.count, dtype=np.uint32))
-    self.vertices = np.column_stack(
-      (
-        ply['vertex'].data['x'].astype(np.float32, copy=False),
-        ply['vertex'].data['y'].astype(np.float32, copy=False),
-        ply['vertex'].data['z'].astype(np.float32, copy=False)
-      )
-    )[indices,:]
-    self.colors = np.column_stack(
-      (
-        ply['vertex'].data['red'].astype(np.uint8, copy=False),
-        ply['vertex'].data['green'].astype(np.uint8, copy=False),
-        ply['vertex'].data['blue'].astype(np.uint8, copy=False),
-        (ply['vertex'].data['confidence'] * 255.0).astype(np.uint8, copy=False)
-      )
-    )[indices,:]
+    self.loadvertices(ply['vertex'].data)
+
+  def loadvertices(self, data):
+    # gather shuffled columns straight into the final layout
+    indices = self.shuffle(data.shape[0])
+    self.setpoints(np.empty((data.shape[0],), dtype=ProjectCloud.POINT_DTYPE))
+    for (i, name) in enumerate(['x', 'y', 'z']):
+      np.take(data[name], indices, out=self.vertices[:,i], mode='clip')
+    for (i, name) in enumerate(['red', 'green', 'blue']):
+      np.take(data[name], indices, out=self.colors[:,i], mode='clip')
+    if 'confidence' in data.dtype.names:
+      self.colors[:,3] = np.clip(np.take(data['confidence'], indices) * 255.0, 0, 255)
+    else:
+      self.colors[:,3] = 255
+    self.buildbbox()
+
+  def loadstream(self, count, dtype, chunks):
+    # scatter each decompressed chunk straight into its shuffled slots
+    order = self.shuffle(count)
+    slots = np.empty((count,), dtype=np.uint32)
+    slots[order] = np.arange(0, count, dtype=np.uint32)
+    self.setpoints(np.empty((count,), dtype=ProjectCloud.POINT_DTYPE))
+    confidence = 'confidence' in dtype.names
+    if not confidence:
+      self.colors[:,3] = 255
+    for (start, data) in chunks:
+      indices = slots[start:start + data.shape[0]]
+      for (i, name) in enumerate(['x', 'y', 'z']):
+        self.vertices[indices,i] = data[name]
+      for (i, name) in enumerate(['red', 'green', 'blue']):
+        self.colors[indices,i] = data[name]
+      if confidence:
+        self.colors[indices,3] = np.clip(data['confidence'] * 255.0, 0, 255)
     self.buildbbox()
 
+  def loaddata(self, vertices, colors):
+    indices = self.shuffle(vertices.shape[0])
+    self.setpoints(np.empty((vertices.shape[0],), dtype=ProjectCloud.POINT_DTYPE))
+    self.vertices[:] = vertices[indices,:]
+    self.colors[:] = colors[indices,:]
+    self.buildbbox()
+
+  def restore(self, points, bbox, order):
+    self.setpoints(points)
+    self.order = order
+    self.bbox1 = bbox[0]
+    self.bbox2 = bbox[1]
+
+  def quantized(self):
+    return self.points.dtype == ProjectCloud.QUANTIZED_DTYPE
+
+  def quantization(self):
+    center = (self.bbox2.astype(np.float64) + self.bbox1) / 2
+    scale = np.maximum((self.bbox2.astype(np.float64) - self.bbox1) / 2, 1e-9)
+    return (center, scale)
+
+  def quantize(self):
+    if self.quantized():
+      return
+    (center, scale) = self.quantization()
+    points = np.zeros((self.count,), dtype=ProjectCloud.QUANTIZED_DTYPE)
+    points['vertex'] = np.clip(
+      np.rint((self.vertices - center) / scale * ProjectCloud.QUANTIZED_RANGE),
+      -ProjectCloud.QUANTIZED_RANGE,
+      ProjectCloud.QUANTIZED_RANGE
+    )
+    points['color'] = self.colors
+    self.setpoints(points)
+
+  def positions(self, indices=None):
+    vertices = self.vertices if indices is None else self.vertices[indices]
+    if not self.quantized():
+      return vertices
+    (center, scale) = self.quantization()
+    return (vertices * (scale / ProjectCloud.QUANTIZED_RANGE) + center).astype(np.float32)
+
+  def mapto(self, path):
+    # unlink first so that older mappings keep their own file
+    path.mkdir(parents=True, exist_ok=True)
+    bbox = np.array([self.bbox1, self.bbox2])
+    for (name, data) in [ ('points.npy', self.points), ('bbox.npy', bbox), ('order.npy', self.order) ]:
+      if (path / name).exists():
+        (path / name).unlink()
+      np.save(path / name, data)
+    self.mapfrom(path)
+
+  def mapfrom(self, path):
+    self.restore(
+      np.load(path / 'points.npy', mmap_mode='r'),
+      np.load(path / 'bbox.npy'),
+      np.load(path / 'order.npy', mmap_mode='r')
+    )
+
   def unload(self):
-    self.count = 0
-    self.vertices = np.array((0,3), dtype=np.float32)
-    self.colors = np.array((0,4), dtype=np.float32)
+    self.setpoints(np.zeros((0,), dtype=ProjectCloud.POINT_DTYPE))
+    self.order = np.zeros((0,), dtype=np.uint32)
 
   def buildbbox(self):
+    if self.quantized():
+      return (self.bbox1, self.bbox2)
+    if self.vertices.size == 0:
+      self.bbox1 = np.zeros((3,), dtype=np.float32)
+      self.bbox2 = np.zeros((3,), dtype=np.float32)
+      return (self.bbox1, self.bbox2)
     self.bbox1 = np.amin(self.vertices, axis=0)
     self.bbox2 = np.amax(self.vertices, axis=0)
     return (self.bbox1, self.bbox2)
+
+
+def openply(filename, workers=1):
+  if filename.endswith('.xz'):
+    return openxz(filename, workers)
+  if filename.endswith('.gz'):
+    return gzip.open(filename)
+  return io.open(filename, 'rb')
+
+def decodecloud(source, quantize, path, workers=1):
+  # runs in a worker process, the decoded cloud is handed back through
+  # memory-mapped files in path
+  cloud = ProjectCloud()
+  if source[0] == 'ply':
+    cloud.loadfile(source[1], workers)
+  else:
+    cloud.loaddata(*readdepthpoints(*source[1:]))
+  if quantize:
+    cloud.quantize()
+  cloud.mapto(Path(path))
+  return cloud.count
@@ -0,0 +1,89 @@
+# history.py: undo/redo history of selection edits
+#
+# author: Antony Ducommun dit Boudry (nitro.tm@gmail.com)
+# license: GPL
+#
+
+import threading
+
+import numpy as np
+
+
+class SelectionEdit(object):
+  # one click and the mesh indices it flipped, per view; deltas are only
+  # valid for the level the view was shown at when the click was applied
+  def __init__(self, click, levels=dict()):
+    self.click = click
+    self.levels = levels
+    self.deltas = dict()
+    self.nbytes = 0
+
+
+  def register(self, view):
+    # the view was built when the click was applied, an empty delta means
+    # the click did not change it
+    if view not in self.deltas:
+      self.deltas[view] = list()
+
+  def record(self, view, indices, include):
+    self.register(view)
+    if indices.shape[0] == 0:
+      return
+    indices = indices.astype(np.uint32)
+    self.deltas[view].append((include, indices))
+    self.nbytes += indices.nbytes
+
+
+class SelectionHistory(object):
+  def __init__(self, maxsize=256*1024*1024):
+    self.maxsize = maxsize
+    self.lock = threading.Lock()
+    self.clear()
+
+
+  def clear(self):
+    self.undos = list()
+    self.redos = list()
+    self.size = 0
+    self.stroke = None
+
+  def clicks(self):
+    # clicks that an undo can still remove from the click log
+    with self.lock:
+      return set([ id(edit.click) for stroke in self.undos for edit in stroke ])
+
+  def begin(self):
+    # following edits are undone together (e.g. one ctrl-drag)
+    self.stroke = None
+
+  def record(self, edit):
+    with self.lock:
+      for stroke in self.redos:
+        self.size -= sum([ item.nbytes for item in stroke ])
+      self.redos = list()
+      if self.stroke is None:
+        self.stroke = list()
+        self.undos.append(self.stroke)
+      self.stroke.append(edit)
+      self.size += edit.nbytes
+      # oldest edits are forgotten first
+      while self.size > self.maxsize and len(self.undos) > 1:
+        self.size -= sum([ item.nbytes for item in self.undos.pop(0) ])
+
+  def undo(self):
+    with self.lock:
+      if len(self.undos) == 0:
+        return None
+      stroke = self.undos.pop()
+      self.redos.append(stroke)
+      self.stroke = None
+      return stroke
+
+  def redo(self):
+    with self.lock:
+      if len(self.redos) == 0:
+        return None
+      stroke = self.redos.pop()
+      self.undos.append(stroke)
+      self.stroke = None
+      return stroke
@@ -0,0 +1,126 @@
+# index.py: project-wide spatial index over view clouds
+#
+# author: Antony Ducommun dit Boudry (nitro.tm@gmail.com)
+# license: GPL
+#
+
+import threading
+
+import numpy as np
+import scipy.spatial as sp
+
+from PySide2.QtCore import QMutexLocker, QRunnable
+
+from project.selection import resolveselection
+
+
+class ProjectIndex(object):
+  def __init__(self, max_leafs=1000, workers=1):
+    self.max_leafs = max_leafs
+    self.workers = workers
+    self.lock = threading.Lock()
+    self.clear()
+
+
+  def clear(self):
+    with self.lock:
+      self.kdtree = None
+      self.views = list()
+      self.generations = list()
+      self.offsets = np.zeros((1,), dtype=np.int64)
+
+  def nbytes(self):
+    with self.lock:
+      if not self.kdtree:
+        return 0
+      return self.kdtree.data.nbytes + self.kdtree.indices.nbytes
+
+  def build(self, views):
+    # concatenate the positions of every built and resident view, points of
+    # view i are stored in [offsets[i], offsets[i+1]); evicted views are
+    # left to their own selection path instead of being reloaded
+    items = list()
+    positions = list()
+    for view in views:
+      with QMutexLocker(view.mutex) as locker:
+        if not view.active or not view.built or not view.mesh or not view.resident:
+          continue
+        if view.cloud.count == 0:
+          continue
+        items.append((view, view.generation))
+        positions.append(np.asarray(view.cloud.positions(), dtype=np.float32))
+    offsets = np.zeros((len(items) + 1,), dtype=np.int64)
+    offsets[1:] = np.cumsum([ item.shape[0] for item in positions ])
+    kdtree = None
+    if len(positions) > 0:
+      kdtree = sp.cKDTree(np.concatenate(positions), self.max_leafs)
+    del positions
+
+    with self.lock:
+      self.kdtree = kdtree
+      self.views = [ view for (view, generation) in items ]
+      self.generations = [ generation for (view, generation) in items ]
+      self.offsets = offsets
+
+    # per-view trees are only needed again once a view changes
+    for (view, generation) in items:
+      with QMutexLocker(view.mutex) as locker:
+        if view.generation == generation:
+          view.kdtree = None
+          view.project.residency.touch(view)
+
+  def select(self, clicks, edit=None):
+    # one batched query, results are split by view offsets and applied
+    # to each view's selection, returns (changed, covered views)
+    with self.lock:
+      kdtree = self.kdtree
+      views = list(zip(self.views, self.generations))
+      offsets = self.offsets
+    if not kdtree:
+      return (False, set())
+    covered = set([ view for (view, generation) in views if view.generation == generation ])
+    if edit:
+      for view in covered:
+        edit.register(view)
+    changed = False
+    for (indices, adds) in resolveselection(kdtree, clicks, self.workers):
+      bounds = np.searchsorted(indices, offsets)
+      for (i, (view, generation)) in enumerate(views):
+        if bounds[i] == bounds[i + 1]:
+          continue
+        with QMutexLocker(view.mutex) as locker:
+          if view.generation != generation or not view.mesh:
+            continue
+          local = indices[bounds[i]:bounds[i + 1]] - offsets[i]
+          add = adds[bounds[i]:bounds[i + 1]]
+          for include in [ True, False ]:
+            flipped = view.mesh.flipSelection(local[add == include], include)
+            if edit:
+              edit.record(view, flipped, include)
+            changed = changed or flipped.shape[0] > 0
+    return (changed, covered)
+
+
+class IndexBuildTask(QRunnable):
+  def __init__(self, project):
+    super(IndexBuildTask, self).__init__()
+    self.project = project
+
+  def run(self):
+    # views built while the index was being built trigger another pass
+    finished = False
+    try:
+      while not finished:
+        with self.project.indexLock:
+          if not self.project.indexStale:
+            self.project.indexPending = False
+            finished = True
+            continue
+          self.project.indexStale = False
+        self.project.index.build(self.project.views)
+        self.project.residency.reserve(self.project.index.nbytes())
+        self.project.message.emit("Spatial index built.")
+    finally:
+      if not finished:
+        with self.project.indexLock:
+          self.project.indexPending = False
@@ -4,20 +4,29 @@
 # license: GPL
 #
 
-import io, json, math, sys, time
+import io, itertools, json, math, multiprocessing, os, shutil, sys, tempfile, threading, time
 
 import numpy as np
 
+from concurrent.futures import ProcessPoolExecutor
+
+from pathlib import Path
+
 from plyfile import PlyData, PlyElement
 
-from PySide2.QtCore import Signal, Slot, Qt, QObject, QThreadPool
+from PySide2.QtCore import Signal, Slot, Qt, QMutexLocker, QObject, QThreadPool
 
 from scene.scene import Scene
 from scene.util import SynchronizedObjectProxy, ObjectProxy
 
+from project.bounds import BoundsTree
+from project.cache import CloudCache, defaultcachepath
+from project.history import SelectionEdit, SelectionHistory
+from project.index import ProjectIndex, IndexBuildTask
+from project.residency import CloudResidency
 from project.scene import ProjectScene
-from project.selection import ProjectSelection
-from project.view import ProjectView, ViewCreateTask, ViewPreselectionTask, ExportSelectionTask, ExportViewTask, ExportViewTarget
+from project.selection import ProjectSelection, ProjectSnapshot, compactselection, readsnapshots, writesnapshots
+from project.view import ProjectView, ViewCreateTask, ViewLevelTask, ViewPreselectionTask, ExportSelectionTask, ExportViewTask, ExportViewTarget
 
 
 class Project(QObject):
@@ -34,18 +43,46 @@ class Project(QObject):
   aspectRatio = Signal(float)
 
 
-  def __init__(self, min_focal=0.5, max_focal=1.0, max_dist=1, max_leafs=1000):
+  def __init__(self, min_focal=0.5, max_focal=1.0, max_dist=1, max_leafs=1000, scan_workers=8, decode_workers=os.cpu_count(), inflate_workers=2, query_workers=-1, cache_size=8*1024*1024*1024, backing_store=False, memory_budget=16*1024*1024*1024, undo_size=256*1024*1024, transfer_path=None):
     super(Project, self).__init__()
     self.renderer = SynchronizedObjectProxy(Scene())
     self.min_focal = min_focal
     self.max_focal = max_focal
     self.max_dist = max_dist
     self.max_leafs = max_leafs
+    self.scan_workers = scan_workers
+    self.decode_workers = decode_workers or 0
+    self.inflate_workers = inflate_workers
+    self.query_workers = query_workers
+    self.decodePool = None
+    self.transferPath = None
+    self.cache = CloudCache(maxsize=cache_size) if cache_size > 0 else None
+    if self.decode_workers > 1:
+      # decoded clouds are written into cache entries, without a cache they
+      # are exchanged through disk-backed files (tmpfs would keep a second
+      # copy in memory)
+      if not self.cache:
+        transfer = Path(transfer_path) if transfer_path else defaultcachepath().parent / 'transfer'
+        transfer.mkdir(parents=True, exist_ok=True)
+        self.transferPath = Path(tempfile.mkdtemp(prefix='3dtagger-', dir=transfer))
+      self.decodePool = ProcessPoolExecutor(self.decode_workers, mp_context=multiprocessing.get_context('spawn'))
+    self.backingPath = Path(tempfile.mkdtemp(prefix='3dtagger-')) if backing_store else None
+    self.residency = CloudResidency(memory_budget)
+    self.index = ProjectIndex(max_leafs, query_workers)
+    self.viewBounds = None
+    self.boundsCounter = itertools.count(1)
+    self.boundsVersion = 0
+    self.indexLock = threading.Lock()
+    self.indexPending = False
+    self.indexStale = False
     self.scenes = dict()
     self.views = list()
     self.viewIndex = 0
 
     self.displayRatio = 1.0
+    self.pointBudget = 20000000
+    self.quantizeClouds = False
+    self.autoLevels = True
     self.clearColor = [0.5, 0.5, 0.5, 1.0]
     self.cloudShaderName = 'cloud-rgb'
     self.cloudShader = ObjectProxy()
@@ -64,9 +101,15 @@ class Project(QObject):
 
     self.selection = list()
     self.selectionRadius = 1.0
+    self.selectionLock = threading.Lock()
+    self.snapshots = dict()
+    self.history = SelectionHistory(undo_size)
+    self.saveClicks = True
+    self.checkpointClicks = False
+    self.compactLimit = 10000
 
     self.threads = QThreadPool()
-    self.threads.setMaxThreadCount(4)
+    self.threads.setMaxThreadCount(max(4, self.decode_workers))
 
     self.exported.connect(self.onexportresult, type=Qt.QueuedConnection)
 
@@ -127,7 +170,10 @@ class Project(QObject):
       if not view.active or view.built:
         continue
       tasks.append(ViewPreselectionTask(self, view))
-    self.startbatch(tasks, progressui)
+    if len(tasks) > 0:
+      self.startbatch(tasks, progressui, self.updateindex)
+    else:
+      self.updateindex()
 
 
   def load(self, filename, progressui=None):
@@ -138,6 +184,8 @@ class Project(QObject):
         raise Exception("unsupported file version")
 
       self.displayRatio = data['displayRatio'] if 'displayRatio' in data else 1.0
+      self.pointBudget = data['pointBudget'] if 'pointBudget' in data else 20000000
+      self.quantizeClouds = data['quantizeClouds'] if 'quantizeClouds' in data else False
       self.clearColor = data['clearColor'] if 'clearColor' in data else (0.5, 0.5, 0.5, 1.0)
       self.cloudShaderName = data['cloudShaderName'] if 'cloudShaderName' in data else 'cloud'
       self.maskPointSize = data['maskPointSize'] if 'maskPointSize' in data else 1.0
@@ -154,6 +202,12 @@ class Project(QObject):
       self.perspectiveCameraConfig = data['perspectiveCamera']
 
       self.selectionRadius = data['selectionRadius'] if 'selectionRadius' in data else 1.0
+      self.saveClicks = data['saveClicks'] if 'saveClicks' in data else True
+      self.checkpointClicks = data['checkpointClicks'] if 'checkpointClicks' in data else False
+      if 'selectionFile' in data:
+        path = Path(filename).parent / data['selectionFile']
+        if path.exists():
+          self.snapshots = readsnapshots(path)
       for selection in data['selection']:
         self.selection.append(
           ProjectSelection(
@@ -172,7 +226,8 @@ class Project(QObject):
             item2['id'],
             item2['active'],
             item2['density'],
-            item2['opacity']
+            item2['opacity'],
+            item2['overviewLevel'] if 'overviewLevel' in item2 else None
           )
         scene = ProjectScene(self, item['name'], item['path'], views)
         self.scenes[item['path']] = scene
@@ -199,6 +254,8 @@ class Project(QObject):
     data['version'] = 'tagger 1.0'
 
     data['displayRatio'] = self.displayRatio
+    data['pointBudget'] = self.pointBudget
+    data['quantizeClouds'] = self.quantizeClouds
     data['clearColor'] = self.clearColor
     data['cloudShaderName'] = self.cloudShaderName
     data['maskPointSize'] = self.maskPointSize
@@ -215,14 +272,23 @@ class Project(QObject):
     data['perspectiveCamera'] = self.perspectiveCamera.save()
 
     data['selectionRadius'] = self.selectionRadius
+    data['saveClicks'] = self.saveClicks
+    data['checkpointClicks'] = self.checkpointClicks
+    if self.checkpointClicks:
+      self.compactselection()
+      self.checkpoint()
+    # saved snapshots include every click, edits before them are final
+    self.history.clear()
+    data['selectionFile'] = self.savesnapshots(Path(filename).with_suffix('.sel')).name
     selection = list()
-    for item in self.selection:
-      selection.append({
-        'pt': item.pt,
-        'radius': item.radius,
-        'add': item.add,
-        'time': item.time
-      })
+    if self.saveClicks:
+      for item in self.selection:
+        selection.append({
+          'pt': item.pt,
+          'radius': item.radius,
+          'add': item.add,
+          'time': item.time
+        })
     data['selection'] = selection
     scenes = list()
     for item in self.scenes.values():
@@ -233,7 +299,8 @@ class Project(QObject):
           'id': item2.id,
           'active': item2.active,
           'density': item2.density,
-          'opacity': item2.opacity
+          'opacity': item2.opacity,
+          'overviewLevel': item2.overviewLevel
         })
       scenes.append({
         'name': item.name,
@@ -248,6 +315,85 @@ class Project(QObject):
     self.saved.emit()
 
 
+  def updatesnapshots(self):
+    # views without an up-to-date selection keep their previous snapshots,
+    # snapshot click counts are relative to the click log
+    names = set([ view.name for view in self.views ])
+    snapshots = dict([ (key, snapshot) for (key, snapshot) in self.snapshots.items() if key[0] in names ])
+    for view in self.views:
+      snapshot = view.snapshot(len(self.selection), snapshots.get((view.name, view.level)))
+      if snapshot:
+        snapshots[(view.name, snapshot.level)] = snapshot
+    self.snapshots = snapshots
+
+  def savesnapshots(self, path):
+    self.updatesnapshots()
+    if self.saveClicks:
+      writesnapshots(path, self.snapshots)
+    else:
+      writesnapshots(path, dict([
+        (key, ProjectSnapshot(snapshot.level, snapshot.count, 0, snapshot.bits))
+        for (key, snapshot) in self.snapshots.items()
+      ]))
+    return path
+
+  def compactselection(self):
+    # drop clicks without any effect on the final selection, snapshot
+    # click counts are remapped to the compacted log; clicks from the first
+    # undoable one onwards are kept as is
+    undoable = self.history.clicks()
+    limit = len(self.selection)
+    for (i, click) in enumerate(self.selection):
+      if id(click) in undoable:
+        limit = i
+        break
+    keep = compactselection(self.selection[:limit]) + list(range(limit, len(self.selection)))
+    if len(keep) == len(self.selection):
+      return
+    kept = np.zeros((len(self.selection) + 1,), dtype=np.int64)
+    kept[np.asarray(keep, dtype=np.int64) + 1] = 1
+    kept = np.cumsum(kept)
+    selection = [ self.selection[i] for i in keep ]
+    snapshots = dict([
+      (key, ProjectSnapshot(snapshot.level, snapshot.count, int(kept[snapshot.clicks]), snapshot.bits))
+      for (key, snapshot) in self.snapshots.items()
+    ])
+    with self.selectionLock:
+      self.selection = selection
+      self.snapshots = snapshots
+    self.message.emit('Selection compacted to %d clicks.' % len(self.selection))
+
+  def checkpoint(self):
+    # fold the click log into snapshots, only the clicks that some level
+    # of some view does not include yet are kept
+    self.updatesnapshots()
+    position = len(self.selection)
+    for view in self.views:
+      if not view.active:
+        continue
+      for level in view.displaylevels():
+        snapshot = self.snapshots.get((view.name, level))
+        position = min(position, snapshot.clicks if snapshot else 0)
+    if position == 0:
+      return
+    selection = self.selection[position:]
+    snapshots = dict([
+      (key, ProjectSnapshot(snapshot.level, snapshot.count, snapshot.clicks - position, snapshot.bits))
+      for (key, snapshot) in self.snapshots.items() if snapshot.clicks >= position
+    ])
+    with self.selectionLock:
+      self.selection = selection
+      self.snapshots = snapshots
+
+  def pendingclicks(self, key):
+    # snapshot of a view level and the clicks logged after it, read
+    # together so that a concurrent compaction cannot split them
+    with self.selectionLock:
+      snapshot = self.snapshots.get(key)
+      if not snapshot:
+        return (None, list())
+      return (snapshot, self.selection[snapshot.clicks:])
+
   def close(self, gl):
     self.threads.clear()
     self.threads.waitForDone()
@@ -257,7 +403,24 @@ class Project(QObject):
     self.renderer.oncleanup(gl)
     self.scenes = dict()
     self.selection = list()
+    self.snapshots = dict()
+    self.history.clear()
     self.views = list()
+    self.residency.clear()
+    self.index.clear()
+    with self.indexLock:
+      self.indexPending = False
+      self.indexStale = False
+    self.viewBounds = None
+    if self.backingPath:
+      shutil.rmtree(self.backingPath, ignore_errors=True)
+      self.backingPath = None
+    if self.decodePool:
+      self.decodePool.shutdown()
+      self.decodePool = None
+    if self.transferPath:
+      shutil.rmtree(self.transferPath, ignore_errors=True)
+      self.transferPath = None
 
     self.message.emit('Project closed.')
     self.stateChanged.emit()
@@ -323,7 +486,14 @@ class Project(QObject):
         continue
       tasks.append(ExportViewTask(self, view, target))
 
-    self.startbatch(tasks, progressui, lambda : target.destroy() )
+    def done():
+      target.destroy()
+      self.autoLevels = True
+
+    # keep the loaded levels while views are rendered one after another
+    if len(tasks) > 0:
+      self.autoLevels = False
+    self.startbatch(tasks, progressui, done)
 
 
   def removeView(self, index):
@@ -409,14 +579,11 @@ class Project(QObject):
     else:
       raise Exception("invalid camera mode")
 
+    self.cameraMode = mode
     for view in self.views:
-      if not view.mesh:
-        continue
-      view.mesh.pointSize = 2.0
-      view.mesh.selectedPointSize = 5.0
-      view.mesh.displayRatio = self.displayRatio
+      self.updatemesh(view)
+    self.updatelevels()
 
-    self.cameraMode = mode
     self.renderer.getPass('overlay').disable()
     self.renderer.getNode('picture').hide()
     self.aspectRatio.emit(0)
@@ -458,6 +625,7 @@ class Project(QObject):
 
     self.viewIndex = index
     view = self.views[self.viewIndex]
+    self.residency.seen(view)
     self.renderer.setDefaultCamera(view.camera)
 
     self.renderer.getPass('overlay').enable()
@@ -475,22 +643,73 @@ class Project(QObject):
       self.aspectRatio.emit(0)
 
     for view2 in self.views:
-      if not view2.mesh:
-        continue
-      if view == view2:
-        view2.mesh.pointSize = 4.0
-        view2.mesh.selectedPointSize = 5.0
-        view2.mesh.displayRatio = 1.0
-      else:
-        view2.mesh.pointSize = 3.0
-        view2.mesh.selectedPointSize = 5.0
-        view2.mesh.displayRatio = self.displayRatio
+      self.updatemesh(view2)
+    self.updatelevels()
 
     self.message.emit('Active camera: view (%s)' % view.name)
     self.stateChanged.emit()
     self.redraw.emit()
 
 
+  def updatemesh(self, view):
+    if not view.mesh:
+      return
+    if self.cameraMode != 'view':
+      view.mesh.pointSize = 2.0
+      view.mesh.selectedPointSize = 5.0
+      view.mesh.displayRatio = self.displayRatio
+    elif view == self.views[self.viewIndex]:
+      view.mesh.pointSize = 4.0
+      view.mesh.selectedPointSize = 5.0
+      view.mesh.displayRatio = 1.0
+    else:
+      view.mesh.pointSize = 3.0
+      view.mesh.selectedPointSize = 5.0
+      view.mesh.displayRatio = self.displayRatio
+
+  def invalidatebounds(self):
+    self.boundsVersion = next(self.boundsCounter)
+
+  def viewbounds(self):
+    # rebuilt lazily when a view cloud has changed since the last build
+    version = self.boundsVersion
+    if not self.viewBounds or self.viewBounds[0] != version:
+      items = list()
+      for view in self.views:
+        bounds = view.bounds
+        if bounds:
+          items.append((view, bounds[0], bounds[1]))
+      self.viewBounds = (version, BoundsTree(items))
+    return self.viewBounds[1]
+
+  def updateindex(self):
+    # rebuild the project-wide index in the background once views are
+    # built, requests made during a build are merged into one more pass
+    with self.indexLock:
+      self.indexStale = True
+      if self.indexPending:
+        return
+      self.indexPending = True
+    self.threads.start(IndexBuildTask(self))
+
+  def updatelevels(self):
+    if not self.autoLevels:
+      return
+    current = None
+    if self.cameraMode == 'view' and len(self.views) > 0:
+      current = self.views[self.viewIndex]
+    for scene in self.scenes.values():
+      for view in scene.views.values():
+        if not view.created or not view.active or view.level is None:
+          continue
+        if view == current:
+          level = view.detaillevel()
+        else:
+          level = view.overviewLevel
+        if level is not None and level != view.level:
+          self.threads.start(ViewLevelTask(self, scene, view, level))
+
+
   @Slot(bool)
   def setCameraAtOrigin(self, allCameras=False):
     self.renderer.defaultCamera.origin()
@@ -638,14 +857,66 @@ class Project(QObject):
       add,
       int(time.time() * 1000)
     )
-    changed = False
-    for scene in self.scenes.values():
-      changed = scene.select([click]) or changed
+    views = self.viewbounds().query(click.pt, click.radius)
+    edit = SelectionEdit(click, dict([ (view, view.level) for view in views ]))
+    (changed, covered) = self.index.select([click], edit)
+    for view in views:
+      if view in covered:
+        continue
+      changed = view.select([click], edit) or changed
     if changed:
       self.selection.append(click)
+      self.history.record(edit)
+      if self.checkpointClicks and len(self.selection) >= self.compactLimit:
+        self.compactselection()
+        self.compactLimit = max(10000, 2 * len(self.selection))
       self.redraw.emit()
 
 
+  @Slot()
+  def beginstroke(self):
+    self.history.begin()
+
+  @Slot()
+  def undo(self):
+    stroke = self.history.undo()
+    if not stroke:
+      return
+    for edit in reversed(stroke):
+      if len(self.selection) > 0 and self.selection[-1] is edit.click:
+        self.selection.pop()
+      else:
+        self.selection = [ click for click in self.selection if click is not edit.click ]
+      self.applyedit(edit, False)
+    self.message.emit('Selection edit undone.')
+    self.redraw.emit()
+
+  @Slot()
+  def redo(self):
+    stroke = self.history.redo()
+    if not stroke:
+      return
+    for edit in stroke:
+      self.selection.append(edit.click)
+      self.applyedit(edit, True)
+    self.message.emit('Selection edit redone.')
+    self.redraw.emit()
+
+  def applyedit(self, edit, forward):
+    # scatter the recorded deltas back, views shown at another level since
+    # the edit or not built when it happened are rebuilt from the click log
+    # instead
+    for (view, level) in edit.levels.items():
+      with QMutexLocker(view.mutex) as locker:
+        if not view.built or not view.mesh:
+          continue
+        if view.level != level or view not in edit.deltas:
+          view.reselect()
+          continue
+        for (include, indices) in edit.deltas.get(view, list()):
+          view.mesh.flipSelection(indices, include if forward else not include)
+
+
   def depth(self, gl, x, y, width, height):
     return self.renderer.depth(gl, x, y, width, height)
 
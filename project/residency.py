@@ -0,0 +1,73 @@
+# residency.py: memory budget for cpu-side view clouds
+#
+# author: Antony Ducommun dit Boudry (nitro.tm@gmail.com)
+# license: GPL
+#
+
+import threading
+
+from collections import OrderedDict
+
+
+class CloudResidency(object):
+  def __init__(self, budget=0):
+    self.budget = budget
+    self.lock = threading.Lock()
+    self.views = OrderedDict()
+    self.total = 0
+    self.reserved = 0
+
+
+  def reserve(self, size):
+    # bytes held outside of any view (e.g. the project-wide index), views
+    # are evicted to make room for them
+    with self.lock:
+      self.total += size - self.reserved
+      self.reserved = size
+      self.trim()
+
+  def touch(self, view):
+    # mark a view as recently used and account its resident bytes, then
+    # evict least recently used views until the budget is met
+    with self.lock:
+      size = view.residentbytes()
+      self.total += size - self.views.pop(view, 0)
+      self.views[view] = size
+      self.trim(view)
+
+  def seen(self, view):
+    # reorder only, the view keeps its current residency
+    with self.lock:
+      if view in self.views:
+        self.views.move_to_end(view)
+
+  def forget(self, view):
+    with self.lock:
+      self.total -= self.views.pop(view, 0)
+
+  def trim(self, keep=None):
+    if self.budget <= 0:
+      return
+    for view in list(self.views.keys()):
+      if self.total <= self.budget:
+        break
+      if view is keep or not view.mutex.tryLock():
+        continue
+      try:
+        if not view.evict():
+          continue
+        size = view.residentbytes()
+      finally:
+        view.mutex.unlock()
+      # views that only dropped their index stay accounted
+      self.total -= self.views[view] - size
+      if size > 0:
+        self.views[view] = size
+      else:
+        del self.views[view]
+
+  def clear(self):
+    with self.lock:
+      self.views = OrderedDict()
+      self.total = 0
+      self.reserved = 0
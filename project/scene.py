@@ -19,7 +19,7 @@ class ProjectScene(object):
     self.name = name
     self.path = path
     self.views = views
-    self.mve = MVEScene(self.path)
+    self.mve = MVEScene(self.path, self.project.scan_workers)
     for item in self.mve.views.items:
       viewName = '%s:%04d' % (self.name, item.id)
       if item.id not in self.views:
@@ -31,6 +31,7 @@ class ProjectScene(object):
       if not view.info:
         view.active = False
     self.renderPass = None
+    self.preview = None
 
 
   def create(self):
@@ -42,16 +43,31 @@ class ProjectScene(object):
       order=11
     )
 
+    (features, refs) = self.mve.features()
+    if len(features) > 0:
+      self.preview = self.project.renderer.addPointCloud('features:%s' % self.name, 3.0, 1.0)
+      self.preview.setData(
+        len(features),
+        np.ascontiguousarray(features['position']),
+        np.ascontiguousarray(features['color'])
+      )
+      self.cloudRenderPass.attachNode(self.preview)
+
   def destroy(self):
     for item in self.views.values():
       item.destroy()
+    if self.preview:
+      self.project.renderer.removeNode(self.preview.name)
+      self.preview = None
     if self.renderPass:
       self.project.renderer.removePass(self.renderPass.name)
       self.renderPass = None
 
 
-  def select(self, clicks):
-    changed = False
+  def updatepreview(self):
+    if not self.preview:
+      return
     for item in self.views.values():
-      changed = item.select(clicks) or changed
-    return changed
+      if item.active and not item.mesh:
+        return
+    self.preview.hide()
@@ -4,6 +4,13 @@
 # license: GPL
 #
 
+import os
+
+import numpy as np
+import scipy.spatial as sp
+
+from pathlib import Path
+
 
 class ProjectSelection(object):
   def __init__(self, pt, radius, add, time):
@@ -22,3 +29,107 @@ class ProjectSelection(object):
       self.radius == o.radius and
       self.add == o.add
     )
+
+
+class ProjectSnapshot(object):
+  # selection of one view as bits packed in source point order (see
+  # ProjectCloud.order), clicks is the length of the click log it includes
+  def __init__(self, level, count, clicks, bits):
+    self.level = level
+    self.count = count
+    self.clicks = clicks
+    self.bits = bits
+
+
+  def mask(self):
+    return np.unpackbits(self.bits, count=self.count).astype(bool)
+
+
+def readsnapshots(path):
+  # snapshots are keyed by (view name, level)
+  snapshots = dict()
+  with np.load(path, allow_pickle=False) as data:
+    for (i, name) in enumerate(data['names']):
+      level = int(data['levels'][i])
+      snapshots[(str(name), level if level >= 0 else None)] = ProjectSnapshot(
+        level if level >= 0 else None,
+        int(data['counts'][i]),
+        int(data['clicks'][i]),
+        data['bits%d' % i]
+      )
+  return snapshots
+
+def writesnapshots(path, snapshots):
+  keys = sorted(snapshots.keys(), key=lambda x: (x[0], -1 if x[1] is None else x[1]))
+  arrays = dict()
+  arrays['names'] = np.array([ name for (name, level) in keys ], dtype=np.str_)
+  arrays['levels'] = np.array([ -1 if level is None else level for (name, level) in keys ], dtype=np.int32)
+  arrays['counts'] = np.array([ snapshots[key].count for key in keys ], dtype=np.int64)
+  arrays['clicks'] = np.array([ snapshots[key].clicks for key in keys ], dtype=np.int64)
+  for (i, key) in enumerate(keys):
+    arrays['bits%d' % i] = snapshots[key].bits
+  tmppath = Path(str(path) + '.tmp')
+  with tmppath.open('wb') as f:
+    np.savez_compressed(f, **arrays)
+  os.replace(tmppath, path)
+
+
+def resolveselection(kdtree, clicks, workers=1, batch=1024):
+  # queries click centers in batches and keeps, for every touched point,
+  # the last click in timestamp order, yields sorted (indices, add) arrays
+  clicks = sorted(clicks, key=lambda click: click.time)
+  for start in range(0, len(clicks), batch):
+    items = clicks[start:start + batch]
+    results = kdtree.query_ball_point(
+      np.array([ click.pt for click in items ], dtype=np.float64).reshape((-1, 3)),
+      np.array([ click.radius for click in items ], dtype=np.float64),
+      workers=workers
+    )
+    lengths = np.array([ len(result) for result in results ], dtype=np.intp)
+    if lengths.sum() == 0:
+      continue
+    indices = np.concatenate([ np.asarray(result, dtype=np.intp) for result in results ])
+    ordinals = np.repeat(np.arange(0, len(items)), lengths)
+    order = np.lexsort((ordinals, indices))
+    indices = indices[order]
+    ordinals = ordinals[order]
+    last = np.append(indices[1:] != indices[:-1], True)
+    adds = np.array([ click.add for click in items ], dtype=bool)
+    yield (indices[last], adds[ordinals[last]])
+
+def compactselection(clicks):
+  # indices of the clicks that still matter, in order: a click fully
+  # contained in a later one is overridden, an add contained in an earlier
+  # add without any intersecting remove in between changes nothing
+  count = len(clicks)
+  if count == 0:
+    return list()
+  centers = np.array([ click.pt for click in clicks ], dtype=np.float64).reshape((-1, 3))
+  radii = np.array([ click.radius for click in clicks ], dtype=np.float64)
+  adds = np.array([ click.add for click in clicks ], dtype=bool)
+  rmax = np.amax(radii)
+  epsilon = 1e-9 * max(1.0, rmax)
+  kdtree = sp.cKDTree(centers)
+  candidates = kdtree.query_ball_point(centers, rmax - radii + epsilon)
+  containing = list()
+  for i in range(count):
+    others = np.asarray(candidates[i], dtype=np.intp)
+    others = others[others != i]
+    distances = np.linalg.norm(centers[others] - centers[i], axis=1)
+    containing.append(others[distances + radii[i] <= radii[others] + epsilon])
+
+  # overridden clicks first, redundant adds must be backed by a click
+  # that survives the first pass
+  overridden = np.array([ np.any(items > i) for (i, items) in enumerate(containing) ], dtype=bool)
+  keep = ~overridden
+  for i in np.nonzero(keep & adds)[0]:
+    earlier = containing[i]
+    earlier = earlier[(earlier < i) & adds[earlier] & ~overridden[earlier]]
+    if earlier.shape[0] == 0:
+      continue
+    first = np.amax(earlier)
+    between = np.asarray(kdtree.query_ball_point(centers[i], radii[i] + rmax), dtype=np.intp)
+    between = between[(between > first) & (between < i) & ~adds[between]]
+    if np.all(np.linalg.norm(centers[between] - centers[i], axis=1) > radii[i] + radii[between]):
+      keep[i] = False
+  return list(np.nonzero(keep)[0])
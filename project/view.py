@@ -4,19 +4,19 @@
 # license: GPL
 #
 
-import cv2, gzip, io, json, lzma, math, sys, time
+import cv2, io, json, math, shutil, sys, time
 
 import numpy as np
 import scipy.spatial as sp
 
-from plyfile import PlyData, PlyElement
-
-from PySide2.QtCore import QMutex, QRunnable, QThread
+from PySide2.QtCore import QMutex, QMutexLocker, QRunnable, QThread
 from PySide2.QtGui import QImage, QOpenGLContext, QOpenGLFramebufferObject, QOffscreenSurface, QSurfaceFormat
 
 from OpenGL import GL
 
-from project.cloud import ProjectCloud
+from project.bounds import intersects
+from project.cloud import ProjectCloud, decodecloud
+from project.selection import ProjectSnapshot, resolveselection
 
 
 class ProjectView(object):
@@ -26,7 +26,7 @@ class ProjectView(object):
   ]
 
 
-  def __init__(self, project, name, id, active=True, density=1.0, opacity=1.0):
+  def __init__(self, project, name, id, active=True, density=1.0, opacity=1.0, overview_level=None):
     self.project = project
     self.name = name
     self.id = id
@@ -34,15 +34,24 @@ class ProjectView(object):
     self.density = density
     self.opacity = opacity
     self.info = None
+    self.mutex = QMutex(QMutex.Recursive)
+    self.generation = 0
+    self.level = None
+    self.overviewLevel = overview_level
     self.created = False
     self.width = 0
     self.height = 0
     self.camera = None
     self.cloud = ProjectCloud()
+    self.cacheKey = None
+    self.backingFile = None
+    self.resident = False
     self.mesh = None
     self.bbox = None
+    self.bounds = None
     self.built = False
     self.kdtree = None
+    self.snapshotVersion = None
 
 
   def valid(self):
@@ -56,24 +65,22 @@ class ProjectView(object):
     self.width = self.info.depthWidth
     self.height = self.info.depthHeight
     plyfilename = self.info.ply()
-    self.active = self.active and plyfilename != None and self.info.robust(self.project.min_focal, self.project.max_focal, self.project.max_dist)
+    hasdepth = self.info.depth() != None
+    self.active = self.active and (plyfilename != None or hasdepth) and self.info.robust(self.project.min_focal, self.project.max_focal, self.project.max_dist)
     if self.active:
       self.camera = self.project.renderer.getViewCamera(self.name, self.info, color=(1.0, 1.0, 0.0))
 
-      self.loadply(plyfilename)
-
-      bcenter = (self.cloud.bbox2 + self.cloud.bbox1) / 2
-      bsize = self.cloud.bbox2 - self.cloud.bbox1
-      self.bbox = self.project.renderer.addBBox('bbox:%s' % self.name, bsize)
-      self.bbox.translate(bcenter[0], bcenter[1], bcenter[2])
-      if not self.project.showBBox:
-        self.bbox.hide()
-
-      self.mesh = self.project.renderer.addPointCloud('cloud:%s' % self.name, 2.0, self.project.displayRatio)
-      self.mesh.setData(self.cloud.count, self.cloud.vertices, self.cloud.colors[:,0:3].copy())
-
-      if not keep_ply:
-        self.cloud.unload()
+      if not plyfilename:
+        if self.overviewLevel not in self.info.levels():
+          self.overviewLevel = None
+        if self.overviewLevel is None:
+          # the budget is shared by depth views, the level is saved with the
+          # project so that it does not change with later imports
+          depthviews = [ view for view in self.project.views if view.active and view.info and not view.info.ply() ]
+          self.overviewLevel = self.info.chooselevel(self.project.pointBudget / max(1, len(depthviews)))
+        if self.level is None:
+          self.level = self.overviewLevel
+      self.createcloud(plyfilename, keep_ply)
     else:
       self.camera = self.project.renderer.getViewCamera(self.name, self.info, lineWidth=0.0, color=(1.0, 0.0, 1.0))
     if not self.project.showLocation:
@@ -86,53 +93,292 @@ class ProjectView(object):
     if self.camera:
       self.project.renderer.removeNode(self.camera.name)
       self.camera = None
+    self.destroycloud()
+
+  def createcloud(self, plyfilename, keep_ply=True):
+    self.loadcloud(plyfilename)
+
+    self.bounds = (np.array(self.cloud.bbox1, dtype=np.float64), np.array(self.cloud.bbox2, dtype=np.float64))
+    self.project.invalidatebounds()
+
+    bcenter = (self.cloud.bbox2 + self.cloud.bbox1) / 2
+    bsize = self.cloud.bbox2 - self.cloud.bbox1
+    self.bbox = self.project.renderer.addBBox('bbox:%s' % self.name, bsize)
+    self.bbox.translate(bcenter[0], bcenter[1], bcenter[2])
+    if not self.project.showBBox:
+      self.bbox.hide()
+
+    self.mesh = self.project.renderer.addPointCloud('cloud:%s' % self.name, 2.0, self.project.displayRatio)
+    self.mesh.setPoints(self.cloud.count, self.cloud.points)
+    if self.cloud.quantized():
+      # GL_SHORT attributes are normalized to [-1, 1] by the shader
+      (qcenter, qscale) = self.cloud.quantization()
+      self.mesh.scale(qscale[0], qscale[1], qscale[2])
+      self.mesh.translate(qcenter[0], qcenter[1], qcenter[2])
+
+    if keep_ply:
+      self.resident = True
+      self.project.residency.touch(self)
+    else:
+      self.cloud.unload()
+
+  def destroycloud(self):
+    self.generation += 1
+    self.project.residency.forget(self)
     self.cloud.unload()
+    self.resident = False
     if self.mesh:
       self.project.renderer.removeNode(self.mesh.name)
       self.mesh = None
     if self.bbox:
       self.project.renderer.removeNode(self.bbox.name)
       self.bbox = None
+    if self.bounds:
+      self.bounds = None
+      self.project.invalidatebounds()
     self.built = False
     self.kdtree = None
+    self.snapshotVersion = None
+
+  def reload(self, level):
+    # swap the cloud for another level, the camera node is kept
+    self.destroycloud()
+    self.level = level
+    self.createcloud(self.info.ply())
+
+  def displaylevels(self):
+    # levels this view can be shown at, None for ply clouds
+    if not self.info or self.info.ply():
+      return [ None ]
+    return list(set([ self.overviewLevel, self.detaillevel() ]))
+
+  def detaillevel(self):
+    if not self.info or self.info.ply():
+      return None
+    levels = self.info.levels()
+    if len(levels) == 0:
+      return None
+    return levels[0]
 
   def buildindex(self):
-    if self.cloud.count > 0:
-      self.kdtree = sp.cKDTree(self.cloud.vertices, self.project.max_leafs)
-    self.built = True
-
-  def select(self, clicks):
-    if not self.built or not self.kdtree:
+    with QMutexLocker(self.mutex) as locker:
+      self.kdtree = None
+      self.require(True)
+      self.built = True
+
+  def select(self, clicks, edit=None):
+    with QMutexLocker(self.mutex) as locker:
+      if not self.built:
+        return False
+      if edit:
+        edit.register(self)
+      clicks = [ click for click in clicks if self.intersects(click.pt, click.radius) ]
+      if len(clicks) == 0:
+        return False
+      self.require(True)
+      if not self.kdtree:
+        return False
+      changed = False
+      for (indices, adds) in resolveselection(self.kdtree, clicks, self.project.query_workers):
+        for include in [ True, False ]:
+          flipped = self.mesh.flipSelection(indices[adds == include], include)
+          if edit:
+            edit.record(self, flipped, include)
+          changed = changed or flipped.shape[0] > 0
+      return changed
+
+  def reselect(self):
+    # rebuild the selection from the snapshot and click log
+    with QMutexLocker(self.mutex) as locker:
+      if not self.built or not self.mesh or self.restoreselection():
+        return
+      self.mesh.clearSelection()
+      self.select(self.project.selection)
+
+  def snapshot(self, clicks, previous=None):
+    # None when the mesh selection does not reflect the click log, the
+    # previous snapshot is reused while the mesh selection is unchanged so
+    # that evicted views are not reloaded
+    with QMutexLocker(self.mutex) as locker:
+      if not self.active or not self.built or not self.mesh:
+        return None
+      if previous and previous.level == self.level and self.snapshotVersion == self.mesh.selectionVersion:
+        return ProjectSnapshot(previous.level, previous.count, clicks, previous.bits)
+      self.require()
+      mask = np.zeros((self.cloud.count,), dtype=bool)
+      mask[self.cloud.order[self.mesh.selectedIndices()]] = True
+      self.snapshotVersion = self.mesh.selectionVersion
+      return ProjectSnapshot(self.level, self.cloud.count, clicks, np.packbits(mask))
+
+  def restoreselection(self):
+    # apply the saved snapshot when it matches this cloud, then replay the
+    # clicks logged after it
+    with QMutexLocker(self.mutex) as locker:
+      (snapshot, clicks) = self.project.pendingclicks((self.name, self.level))
+      if not snapshot or not self.active or not self.mesh:
+        return False
+      self.require()
+      if snapshot.count != self.cloud.count:
+        return False
+      self.mesh.setSelection(snapshot.mask()[self.cloud.order])
+      self.snapshotVersion = self.mesh.selectionVersion
+      self.built = True
+      self.select(clicks)
+      return True
+
+  def intersects(self, pt, radius):
+    return self.bounds is not None and intersects(np.asarray(pt, dtype=np.float64), radius, self.bounds[0], self.bounds[1])
+
+  def require(self, index=False):
+    # reload what the residency manager evicted, selection state lives in
+    # the mesh and is kept across evictions
+    if not self.active or not self.mesh:
+      return
+    if not self.resident:
+      if self.backingFile:
+        self.cloud.mapfrom(self.backingFile)
+      else:
+        self.loadcloud(self.info.ply())
+      self.resident = True
+    if index and not self.kdtree and self.cloud.count > 0:
+      self.kdtree = self.loadindex()
+    self.project.residency.touch(self)
+
+  def loadindex(self):
+    cache = self.project.cache
+    if cache and self.cacheKey:
+      kdtree = cache.loadindex(self.cacheKey, self.project.max_leafs)
+      if kdtree is not None and kdtree.n == self.cloud.count:
+        return kdtree
+    kdtree = sp.cKDTree(self.cloud.positions(), self.project.max_leafs)
+    if cache and self.cacheKey:
+      cache.storeindex(self.cacheKey, self.project.max_leafs, kdtree)
+    return kdtree
+
+  def cachedindex(self):
+    cache = self.project.cache
+    return cache is not None and self.cacheKey is not None and cache.hasindex(self.cacheKey, self.project.max_leafs)
+
+  def evict(self):
+    # the kd-tree is always dropped; the gpu copy is kept and only uploaded
+    # clouds are unloaded, the mesh keeps the memory-mapped points to upload
+    # them again so clouds that only live in memory stay resident
+    if not self.resident or not self.mesh:
+      return False
+    released = self.kdtree is not None
+    self.kdtree = None
+    if isinstance(self.cloud.points, np.memmap) and self.mesh.releasePoints(self.cloud.points):
+      self.cloud.unload()
+      self.resident = False
+      released = True
+    return released
+
+  def residentbytes(self):
+    size = 0
+    if self.resident:
+      size += self.cloud.points.nbytes + self.cloud.order.nbytes
+    if self.kdtree:
+      size += self.kdtree.data.nbytes + self.kdtree.indices.nbytes
+    return size
+
+  def loadcloud(self, plyfilename):
+    cache = self.project.cache
+    quantize = self.project.quantizeClouds
+    key = None
+    self.cacheKey = None
+    self.backingFile = None
+    if cache:
+      if plyfilename:
+        key = cache.key([plyfilename], 'ply:q16' if quantize else 'ply')
+      else:
+        key = cache.key(
+          [self.info.depth(self.level), self.info.depthcolor(self.level), self.info.depthconf(self.level)],
+          'depth:q16' if quantize else 'depth'
+        )
+      self.cacheKey = key
+      cached = cache.load(key)
+      if cached:
+        self.cloud.restore(*cached)
+        return
+    if self.decode(plyfilename, quantize, key):
+      return
+    cached = None
+    if key:
+      cache.store(
+        key,
+        self.cloud.points,
+        np.array([self.cloud.bbox1, self.cloud.bbox2]),
+        self.cloud.order
+      )
+      cached = cache.load(key)
+    # drop the in-memory copy, pages are loaded back on access
+    if cached:
+      self.cloud.restore(*cached)
+    elif self.project.backingPath:
+      self.backingFile = self.project.backingPath / self.name.replace(':', '_')
+      self.cloud.mapto(self.backingFile)
+
+  def decode(self, plyfilename, quantize, key=None):
+    # returns True when the decoded cloud was written to the cache entry
+    processes = self.project.decodePool
+    if not processes:
+      if plyfilename:
+        self.loadply(plyfilename)
+      else:
+        self.loaddepth()
+      if quantize:
+        self.cloud.quantize()
       return False
-    changed = False
-    for click in clicks:
-      indices = self.kdtree.query_ball_point(click.pt, click.radius)
-      changed = self.mesh.updateSelection(indices, click.add) or changed
-    return changed
 
-  def loadply(self, filename):
-    if filename.endswith('.xz'):
-      with lzma.open(filename) as f:
-        self.cloud.load(PlyData.read(f))
-    elif filename.endswith('.gz'):
-      with gzip.open(filename) as f:
-        self.cloud.load(PlyData.read(f))
+    # decoding is cpu bound, run it outside of the interpreter lock and
+    # map the result back without copying it through a pipe; the worker
+    # writes straight into a cache entry when the cache is enabled
+    if plyfilename:
+      source = ('ply', plyfilename)
     else:
-      with io.open(filename, 'rb') as f:
-        self.cloud.load(PlyData.read(f))
+      source = ('depth',) + self.info.depthpoints(level=self.level)
+    cache = self.project.cache
+    if key:
+      path = cache.tmpentry(key)
+    else:
+      path = self.project.transferPath / ('%s.%d' % (self.name.replace(':', '_'), id(self)))
+    try:
+      processes.submit(decodecloud, source, quantize, str(path), self.project.inflate_workers).result()
+      self.cloud.mapfrom(path)
+    except:
+      shutil.rmtree(path, ignore_errors=True)
+      raise
+    # mappings stay valid once the files are renamed or unlinked
+    if key:
+      return cache.commit(key, path)
+    shutil.rmtree(path, ignore_errors=True)
+    return False
+
+  def loadply(self, filename):
+    self.cloud.loadfile(filename, self.project.inflate_workers)
+
+  def loaddepth(self):
+    (vertices, colors) = self.info.readpoints(level=self.level)
+    self.cloud.loaddata(vertices, colors)
 
   def exportSelection(self, clicks):
-    if not self.active or not self.mesh or self.cloud.count == 0:
-      return np.zeros((0,), dtype=ProjectView.EXPORT_DTYPE)
-    indices = list(self.mesh.selectedIndices)
+    with QMutexLocker(self.mutex) as locker:
+      if not self.active or not self.mesh:
+        return np.zeros((0,), dtype=ProjectView.EXPORT_DTYPE)
+      self.require()
+      if self.cloud.count == 0:
+        return np.zeros((0,), dtype=ProjectView.EXPORT_DTYPE)
+      indices = self.mesh.selectedIndices()
+      points = self.cloud.points[indices]
+      vertices = self.cloud.positions(indices)
     a = np.zeros((len(indices),), dtype=ProjectView.EXPORT_DTYPE)
-    a['x'] = self.cloud.vertices[indices,0]
-    a['y'] = self.cloud.vertices[indices,1]
-    a['z'] = self.cloud.vertices[indices,2]
-    a['red'] = self.cloud.colors[indices,0]
-    a['green'] = self.cloud.colors[indices,1]
-    a['blue'] = self.cloud.colors[indices,2]
-    a['alpha'] = self.cloud.colors[indices,3]
+    a['x'] = vertices[:,0]
+    a['y'] = vertices[:,1]
+    a['z'] = vertices[:,2]
+    a['red'] = points['color'][:,0]
+    a['green'] = points['color'][:,1]
+    a['blue'] = points['color'][:,2]
+    a['alpha'] = points['color'][:,3]
     return a
 
   def exportImage(self, target):
@@ -165,14 +411,20 @@ class ViewCreateTask(QRunnable):
 
   def run(self):
     try:
-      if not self.view.created:
-        self.view.create()
-        if self.view.camera:
-          self.scene.renderPass.attachNode(self.view.camera)
-        if self.view.bbox:
-          self.scene.renderPass.attachNode(self.view.bbox)
-        if self.view.mesh:
-          self.scene.cloudRenderPass.attachNode(self.view.mesh)
+      with QMutexLocker(self.view.mutex) as locker:
+        if not self.view.created:
+          self.view.create()
+          if self.view.camera:
+            self.scene.renderPass.attachNode(self.view.camera)
+          if self.view.bbox:
+            self.scene.renderPass.attachNode(self.view.bbox)
+          if self.view.mesh:
+            self.scene.cloudRenderPass.attachNode(self.view.mesh)
+          self.scene.updatepreview()
+          if self.view.restoreselection():
+            self.project.updateindex()
+          if self.view.mesh and self.view.kdtree is None and self.view.cachedindex():
+            self.project.threads.start(ViewIndexTask(self.project, self.view))
 
       self.project.message.emit("View %s built." % self.view.name)
       self.project.redraw.emit()
@@ -180,6 +432,58 @@ class ViewCreateTask(QRunnable):
       self.project.progresstick.emit()
 
 
+class ViewLevelTask(QRunnable):
+  def __init__(self, project, scene, view, level):
+    super(ViewLevelTask, self).__init__()
+    self.project = project
+    self.scene = scene
+    self.view = view
+    self.level = level
+
+  def run(self):
+    with QMutexLocker(self.view.mutex) as locker:
+      if not self.view.created or not self.view.active or self.view.level == self.level:
+        return
+      built = self.view.built
+      self.view.reload(self.level)
+      if self.view.bbox:
+        self.scene.renderPass.attachNode(self.view.bbox)
+      if self.view.mesh:
+        self.scene.cloudRenderPass.attachNode(self.view.mesh)
+        self.project.updatemesh(self.view)
+      if not self.view.restoreselection() and built:
+        self.view.buildindex()
+        self.view.select(self.project.selection)
+      if self.view.built:
+        self.project.updateindex()
+
+    self.project.message.emit("View %s loaded at level %d." % (self.view.name, self.level))
+    self.project.redraw.emit()
+
+
+class ViewIndexTask(QRunnable):
+  def __init__(self, project, view):
+    super(ViewIndexTask, self).__init__()
+    self.project = project
+    self.view = view
+
+  def run(self):
+    # background load of a cached index, no batch progress is reported;
+    # views restored from a snapshot are already built and only preload it
+    with QMutexLocker(self.view.mutex) as locker:
+      if not self.view.active or not self.view.mesh or self.view.kdtree is not None:
+        return
+      if self.view.built:
+        self.view.require(True)
+      else:
+        self.view.buildindex()
+        self.view.select(self.project.selection)
+        self.project.updateindex()
+
+    self.project.message.emit("View %s indexed." % self.view.name)
+    self.project.redraw.emit()
+
+
 class ViewPreselectionTask(QRunnable):
   def __init__(self, project, view):
     super(ViewPreselectionTask, self).__init__()
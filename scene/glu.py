@@ -26,6 +26,13 @@ def gluTranslate3(tx, ty, tz):
   m[2,3] = tz
   return m
 
+def gluScale3(sx, sy, sz):
+  m = gluIdentity()
+  m[0,0] = sx
+  m[1,1] = sy
+  m[2,2] = sz
+  return m
+
 def gluRotate3(a, rx, ry, rz):
   r = norm(np.array([rx, ry, rz]))
   c = math.cos(a * math.pi / 180)
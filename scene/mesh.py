@@ -4,7 +4,7 @@
 # license: GPL
 #
 
-import array, ctypes, math
+import array, ctypes, math, threading
 import numpy as np
 import scipy.spatial as sp
 
@@ -175,7 +175,12 @@ class MeshDrawElements(MeshDrawCommand):
 
 
 class MeshVertexBuffer(object):
+  # dirty ranges are tracked by pages of vertices
+  PAGE_SIZE = 1024
+  MAX_RUNS = 256
+
   def __init__(self, vertices=0):
+    self.lock = threading.Lock()
     self.update(vertices)
     self.uniforms = dict()
     self.buffer = None
@@ -184,35 +189,102 @@ class MeshVertexBuffer(object):
     self.vertices = vertices
     self.attributes = dict()
     self.offsets = dict()
+    self.interleaved = None
     self.size = 0
     self.changed = True
+    self.dirty = dict()
 
   def add(self, name, data, count=3, datatype=GL.GL_FLOAT):
     self.attributes[name] = MeshVertexAttribute(name, data, count, datatype)
     self.changed = True
 
+  def addInterleaved(self, data, fields):
+    # fields: (attribute name, record field name, count, datatype)
+    self.interleaved = data
+    for (name, field, count, datatype) in fields:
+      self.attributes[name] = MeshVertexAttribute(
+        name,
+        None,
+        count,
+        datatype,
+        stride=data.dtype.itemsize,
+        offset=data.dtype.fields[field][1]
+      )
+    self.changed = True
+
   def remove(self, name):
     if name in self.attributes:
       del self.attributes[name]
       self.changed = True
 
+  def invalidate(self, name, indices=None):
+    # mark vertices of an attribute as modified (all when indices is None),
+    # they are written in place on the next enable()
+    if indices is None:
+      pages = np.arange(0, (self.vertices + MeshVertexBuffer.PAGE_SIZE - 1) // MeshVertexBuffer.PAGE_SIZE)
+    else:
+      pages = np.unique(np.asarray(indices) // MeshVertexBuffer.PAGE_SIZE)
+    with self.lock:
+      if name in self.dirty:
+        pages = np.union1d(self.dirty[name], pages)
+      self.dirty[name] = pages
+
   def create(self, gl):
     if not self.buffer:
       self.buffer = QOpenGLBuffer(QOpenGLBuffer.VertexBuffer)
     if not self.buffer.isCreated() and not self.buffer.create():
       raise Exception("buffer creation failed!")
     self.buffer.bind()
+    with self.lock:
+      self.dirty = dict()
     self.offsets = dict()
     self.size = 0
+    if self.interleaved is not None:
+      self.size = self.vertices * self.interleaved.dtype.itemsize
     for item in self.attributes.values():
+      if item.offset is not None:
+        self.offsets[item.name] = item.offset
+        continue
       self.offsets[item.name] = self.size
       self.size += self.vertices * item.count * item.datasize
     self.buffer.allocate(self.size)
+    if self.interleaved is not None:
+      self.buffer.write(0, self.interleaved.data, self.vertices * self.interleaved.dtype.itemsize)
     for item in self.attributes.values():
+      if item.offset is not None:
+        continue
       self.buffer.write(self.offsets[item.name], item.data.data, self.vertices * item.count * item.datasize)
     self.buffer.release()
     self.changed = False
 
+  def flush(self, gl):
+    # rewrite runs of modified pages, the buffer keeps its allocation
+    with self.lock:
+      (dirty, self.dirty) = (self.dirty, dict())
+    self.buffer.bind()
+    for (name, pages) in dirty.items():
+      item = self.attributes.get(name)
+      if not item or item.offset is not None or pages.shape[0] == 0:
+        continue
+      breaks = np.nonzero(np.diff(pages) != 1)[0] + 1
+      starts = pages[np.concatenate(([0], breaks))]
+      ends = pages[np.concatenate((breaks - 1, [pages.shape[0] - 1]))] + 1
+      if starts.shape[0] > MeshVertexBuffer.MAX_RUNS:
+        starts = [ starts[0] ]
+        ends = [ ends[-1] ]
+      stride = item.count * item.datasize
+      for (start, end) in zip(starts, ends):
+        first = int(start) * MeshVertexBuffer.PAGE_SIZE
+        last = min(int(end) * MeshVertexBuffer.PAGE_SIZE, self.vertices)
+        if first >= last:
+          continue
+        self.buffer.write(
+          self.offsets[name] + first * stride,
+          np.ascontiguousarray(item.data[first:last]).data,
+          (last - first) * stride
+        )
+    self.buffer.release()
+
   def destroy(self, gl):
     if not self.buffer:
       return
@@ -223,11 +295,13 @@ class MeshVertexBuffer(object):
   def enable(self, gl, shader):
     if self.changed:
       self.create(gl)
+    elif self.dirty:
+      self.flush(gl)
     shader.setUniforms(self.uniforms)
     self.buffer.bind()
     for item in self.attributes.values():
       if item.enabled:
-        shader.setAttributeArray(item.name, item.datatype, self.offsets[item.name], item.count)
+        shader.setAttributeArray(item.name, item.datatype, self.offsets[item.name], item.count, item.stride)
     self.buffer.release()
 
   def disable(self, gl, shader):
@@ -288,11 +362,13 @@ class MeshIndexBuffer(object):
 
 
 class MeshVertexAttribute(object):
-  def __init__(self, name, data, count=3, datatype=GL.GL_FLOAT):
+  def __init__(self, name, data, count=3, datatype=GL.GL_FLOAT, stride=0, offset=None):
     self.name = name
     self.data = data
     self.count = count
     self.datatype = datatype
+    self.stride = stride
+    self.offset = offset
     if datatype == GL.GL_BYTE or datatype == GL.GL_UNSIGNED_BYTE:
       self.datasize = 1
     elif datatype == GL.GL_SHORT or datatype == GL.GL_UNSIGNED_SHORT:
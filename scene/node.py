@@ -8,7 +8,7 @@ import array, json, time
 
 from OpenGL import GL
 
-from scene.glu import gluIdentity, gluTranslate3, gluRotate3
+from scene.glu import gluIdentity, gluTranslate3, gluRotate3, gluScale3
 
 
 class Node(object):
@@ -96,6 +96,10 @@ class Node(object):
     self.mMatrix = gluRotate3(a, ax, ay, az) @ self.mMatrix
     self.moved = True
 
+  def scale(self, sx=1, sy=1, sz=1):
+    self.mMatrix = gluScale3(sx, sy, sz) @ self.mMatrix
+    self.moved = True
+
 
   def oncreate(self, gl):
     if not self.created:
@@ -19,6 +19,7 @@ class PointCloud(Mesh):
   def __init__(self, scene, pointSize=1.0, displayRatio=1.0):
     super(PointCloud, self).__init__(scene, pointSize)
     self.displayRatio = displayRatio
+    self.selectionVersion = 0
 
     self.selection = MeshVertexBuffer()
 
@@ -50,29 +51,74 @@ class PointCloud(Mesh):
 
     self.selection.update(count)
     self.selection.add('selection', np.zeros((count), dtype=np.uint8), count=1, datatype=GL.GL_UNSIGNED_BYTE)
+    self.selectionVersion += 1
 
 
-  def updateSelection(self, indices, include):
-    changed = False
-    if include:
-      for index in indices:
-        if self.selection.attributes['selection'].data[index]:
-          continue
-        self.selection.attributes['selection'].data[index] = 1
-        changed = True
+  def setPoints(self, count, points):
+    # interleaved records with a 'vertex' (3 x float or normalized short)
+    # and 'color' (4 x ubyte) field
+    if points.shape[0] != count:
+      raise Exception("invalid points shape")
+    if points.dtype['vertex'].base == np.int16:
+      vertexType = GL.GL_SHORT
     else:
-      for index in indices:
-        if not self.selection.attributes['selection'].data[index]:
-          continue
-        self.selection.attributes['selection'].data[index] = 0
-        changed = True
-    if changed:
-      self.selection.changed = True
-    return changed
+      vertexType = GL.GL_FLOAT
+    self.points.vertexBuffer.update(count)
+    self.points.vertexBuffer.addInterleaved(
+      np.ascontiguousarray(points),
+      [
+        ('vertex3', 'vertex', 3, vertexType),
+        ('color3', 'color', 3, GL.GL_UNSIGNED_BYTE)
+      ]
+    )
+    self.points.vertexBuffer.uniforms['colors'] = [3]
+    self.points.enabled = count > 0
+
+    self.selection.update(count)
+    self.selection.add('selection', np.zeros((count), dtype=np.uint8), count=1, datatype=GL.GL_UNSIGNED_BYTE)
+    self.selectionVersion += 1
+
+
+  def releasePoints(self, points):
+    # swap the cpu-side copy for a memory-mapped one once it has been
+    # uploaded, points must hold the same records and are only read again
+    # if the buffer is recreated
+    if self.points.vertexBuffer.changed or not self.points.vertexBuffer.buffer:
+      return False
+    if points.shape[0] != self.points.vertexBuffer.vertices or points.dtype != self.points.vertexBuffer.interleaved.dtype:
+      raise Exception("invalid points shape")
+    self.points.vertexBuffer.interleaved = points
+    return True
+
+
+  def updateSelection(self, indices, include):
+    return self.flipSelection(indices, include).shape[0] > 0
+
+  def flipSelection(self, indices, include):
+    # gather the touched flags, keep only the ones that flip and scatter,
+    # returns the flipped indices
+    data = self.selection.attributes['selection'].data
+    indices = np.asarray(indices, dtype=np.intp)
+    value = 1 if include else 0
+    indices = indices[data[indices] != value]
+    if indices.shape[0] > 0:
+      data[indices] = value
+      self.selection.invalidate('selection', indices)
+      self.selectionVersion += 1
+    return indices
+
+  def selectedIndices(self):
+    return np.nonzero(self.selection.attributes['selection'].data)[0]
+
+  def setSelection(self, mask):
+    self.selection.attributes['selection'].data[:] = mask
+    self.selection.invalidate('selection')
+    self.selectionVersion += 1
 
   def clearSelection(self):
     self.selection.attributes['selection'].data *= 0
-    self.selection.changed = True
+    self.selection.invalidate('selection')
+    self.selectionVersion += 1
 
 
   def prerenderimpl(self, gl, camera, shader):
@@ -0,0 +1,35 @@
+# test_quantize.py: quantized cloud transform checks
+#
+# author: Antony Ducommun dit Boudry (nitro.tm@gmail.com)
+# license: GPL
+#
+
+import numpy as np
+import pytest
+
+from project.cloud import ProjectCloud
+
+pytest.importorskip('OpenGL')
+
+from scene.node import Node
+
+
+def test_quantized_node_matrix():
+  points = np.zeros((1000,), dtype=ProjectCloud.POINT_DTYPE)
+  points['vertex'] = np.random.RandomState(0).uniform(-50, 120, (1000, 3))
+  cloud = ProjectCloud(points)
+  cloud.quantize()
+  assert cloud.quantized()
+
+  # same transform as ProjectView.create
+  node = Node(None, 'cloud')
+  (qcenter, qscale) = cloud.quantization()
+  node.scale(qscale[0], qscale[1], qscale[2])
+  node.translate(qcenter[0], qcenter[1], qcenter[2])
+
+  # normalized GL_SHORT attribute as seen by the vertex shader
+  vertices = cloud.vertices.astype(np.float64) / ProjectCloud.QUANTIZED_RANGE
+  vertices = np.concatenate([ vertices, np.ones((cloud.count, 1)) ], axis=1)
+  world = (node.mMatrix @ vertices.T).T[:,0:3]
+  assert np.allclose(world, cloud.positions(), atol=1e-3)
+  assert np.allclose(world, points['vertex'], atol=np.max(qscale) / ProjectCloud.QUANTIZED_RANGE)
@@ -24,6 +24,7 @@ class View(QOpenGLWidget, QOpenGLFunctions):
   removeView    = Signal()
 
   selected      = Signal(float, float, float, bool)
+  strokeStarted = Signal()
 
 
   def __init__(self, window, project):
@@ -49,6 +50,7 @@ class View(QOpenGLWidget, QOpenGLFunctions):
     self.togglePicture.connect(self.project.togglePicture, type=Qt.QueuedConnection)
     self.removeView.connect(self.project.removeCurrentView, type=Qt.QueuedConnection)
     self.selected.connect(self.project.select, type=Qt.QueuedConnection)
+    self.strokeStarted.connect(self.project.beginstroke, type=Qt.QueuedConnection)
 
 
   @Slot(float)
@@ -176,6 +178,7 @@ class View(QOpenGLWidget, QOpenGLFunctions):
           self.makeCurrent()
           pt = self.project.unproject(self, x, y, self.width(), self.height())
           self.doneCurrent()
+          self.strokeStarted.emit()
           self.selected.emit(pt[0], pt[1], pt[2], not self.shiftKey)
 
   def mouseMoveEvent(self, event):
@@ -235,6 +235,23 @@ class Window(QMainWindow):
       enabled=False
     )
 
+    self.undoAct = QAction(
+      "&Undo selection",
+      self,
+      shortcut=QKeySequence.Undo,
+      statusTip="Undo last selection edit",
+      triggered=self.undoSelection,
+      enabled=False
+    )
+    self.redoAct = QAction(
+      "&Redo selection",
+      self,
+      shortcut=QKeySequence.Redo,
+      statusTip="Redo last undone selection edit",
+      triggered=self.redoSelection,
+      enabled=False
+    )
+
     self.preselectAct = QAction(
       "Build/apply selection",
       self,
@@ -268,6 +285,10 @@ class Window(QMainWindow):
     fileMenu.addSeparator()
     fileMenu.addAction(self.exitAct)
 
+    editMenu = self.menuBar().addMenu("&Edit")
+    editMenu.addAction(self.undoAct)
+    editMenu.addAction(self.redoAct)
+
     viewMenu = self.menuBar().addMenu("&View")
     viewMenu.addAction(self.orthoCameraAct)
     viewMenu.addAction(self.perspectiveCameraAct)
@@ -386,6 +407,8 @@ class Window(QMainWindow):
       self.toggleBBoxAct,
       self.togglePhotoAct,
       self.shaderMenu,
+      self.undoAct,
+      self.redoAct,
       self.preselectAct,
       self.editorAct,
     ]
@@ -543,6 +566,12 @@ class Window(QMainWindow):
         raise e
 
 
+  def undoSelection(self):
+    self.project.undo()
+
+  def redoSelection(self):
+    self.project.redo()
+
   def preselect(self):
     progress = QProgressDialog('', None, 0, 100, self)
     try:
@@ -0,0 +1,127 @@
+# xz.py: parallel decompression of multi-stream xz files
+#
+# see https://tukaani.org/xz/xz-file-format.txt
+#
+# author: Antony Ducommun dit Boudry (nitro.tm@gmail.com)
+# license: GPL
+#
+
+import io, lzma, struct
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+XZ_HEADER_MAGIC = b'\xfd7zXZ\x00'
+XZ_FOOTER_MAGIC = b'YZ'
+XZ_HEADER_SIZE = 12
+XZ_FOOTER_SIZE = 12
+
+
+def readvli(data, offset):
+  # variable-length integer, 7 bits per byte
+  value = 0
+  for i in range(9):
+    byte = data[offset + i]
+    value |= (byte & 0x7f) << (7 * i)
+    if byte & 0x80 == 0:
+      return (value, offset + i + 1)
+  raise Exception('Invalid xz integer')
+
+def xzstreams(path):
+  # walk the file backwards from the last stream footer, returns the
+  # (offset, size) of each stream in file order
+  streams = list()
+  with Path(path).open('rb') as f:
+    pos = f.seek(0, io.SEEK_END)
+    while pos > 0:
+      # skip stream padding
+      f.seek(pos - 4)
+      if f.read(4) == b'\x00\x00\x00\x00':
+        pos -= 4
+        continue
+      if pos < XZ_HEADER_SIZE + XZ_FOOTER_SIZE:
+        raise Exception('Invalid xz file: %s' % path)
+      f.seek(pos - XZ_FOOTER_SIZE)
+      footer = f.read(XZ_FOOTER_SIZE)
+      if footer[10:12] != XZ_FOOTER_MAGIC:
+        raise Exception('Invalid xz stream footer: %s' % path)
+      indexsize = (struct.unpack('<I', footer[4:8])[0] + 1) * 4
+      indexpos = pos - XZ_FOOTER_SIZE - indexsize
+      f.seek(indexpos)
+      index = f.read(indexsize)
+      if index[0] != 0:
+        raise Exception('Invalid xz index: %s' % path)
+      (records, offset) = readvli(index, 1)
+      blocks = 0
+      for i in range(records):
+        (unpadded, offset) = readvli(index, offset)
+        (uncompressed, offset) = readvli(index, offset)
+        blocks += (unpadded + 3) & ~3
+      start = indexpos - blocks - XZ_HEADER_SIZE
+      f.seek(start)
+      if start < 0 or f.read(6) != XZ_HEADER_MAGIC:
+        raise Exception('Invalid xz stream header: %s' % path)
+      streams.append((start, pos - start))
+      pos = start
+  streams.reverse()
+  return streams
+
+
+class XZStreamReader(io.RawIOBase):
+  # decompresses independent streams in worker threads, at most workers
+  # streams are kept in flight
+  def __init__(self, path, streams, workers):
+    super(XZStreamReader, self).__init__()
+    self.file = Path(path).open('rb')
+    self.streams = deque(streams)
+    self.executor = ThreadPoolExecutor(workers)
+    self.pending = deque()
+    self.workers = workers
+    self.current = memoryview(b'')
+    self.offset = 0
+    self.position = 0
+    self.schedule()
+
+  def schedule(self):
+    while self.streams and len(self.pending) < self.workers:
+      (start, size) = self.streams.popleft()
+      self.file.seek(start)
+      self.pending.append(self.executor.submit(lzma.decompress, self.file.read(size), lzma.FORMAT_XZ))
+
+  def readable(self):
+    return True
+
+  def tell(self):
+    return self.position
+
+  def readinto(self, b):
+    while self.offset >= len(self.current):
+      if not self.pending:
+        return 0
+      self.current = memoryview(self.pending.popleft().result())
+      self.offset = 0
+      self.schedule()
+    count = min(len(b), len(self.current) - self.offset)
+    b[0:count] = self.current[self.offset:self.offset + count]
+    self.offset += count
+    self.position += count
+    return count
+
+  def close(self):
+    if not self.closed:
+      for future in self.pending:
+        future.cancel()
+      self.executor.shutdown()
+      self.file.close()
+    super(XZStreamReader, self).close()
+
+
+def openxz(path, workers=1):
+  # single-stream files are decoded sequentially
+  if workers > 1:
+    streams = xzstreams(path)
+    if len(streams) > 1:
+      return io.BufferedReader(XZStreamReader(path, streams, workers))
+  return lzma.open(path)